@@ -0,0 +1,74 @@
+import pytest
+import sys
+
+from collections import namedtuple
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--max-hosts', type=int, default=100,
+        help='skip benchmarks with more hosts than this (default: 100)')
+
+
+@pytest.fixture
+def max_hosts(request):
+    return request.config.getoption('--max-hosts')
+
+
+@pytest.fixture
+def local_hosts(max_hosts):
+    """ Returns a function creating the given number of aliases of
+    localhost, reached through the local connection.
+
+    """
+
+    def local_hosts(count):
+        if count > max_hosts:
+            pytest.skip('more than {} hosts'.format(max_hosts))
+
+        return {
+            'host{}'.format(i): {
+                'ansible_connection': 'local',
+                'ansible_python_interpreter': sys.executable,
+            }
+            for i in range(count)
+        }
+
+    return local_hosts
+
+
+Host = namedtuple('Host', ('name', ))
+
+
+class TaskResult(object):
+    """ Mimics the task results passed to callbacks by Ansible. """
+
+    def __init__(self, host, result):
+        self._host = Host(host)
+        self._result = result
+
+
+@pytest.fixture
+def task_results():
+    """ Returns a function creating task results of the command module for
+    the given number of hosts.
+
+    """
+
+    def task_results(count):
+        return [
+            TaskResult('host{}'.format(i), {
+                'cmd': ['uptime'],
+                'rc': 0,
+                'changed': True,
+                'stdout': ' 10:00:00 up 1 day,  1 user,  load average: 0.00',
+                'stdout_lines': [
+                    ' 10:00:00 up 1 day,  1 user,  load average: 0.00'
+                ],
+                'stderr': '',
+                'stderr_lines': [],
+            })
+            for i in range(count)
+        ]
+
+    return task_results
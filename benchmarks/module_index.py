@@ -0,0 +1,113 @@
+""" Compares the startup cost of listing the available Ansible modules.
+
+    python benchmarks/module_index.py [--synthetic 5000]
+
+Measures the original filesystem scan against the module index in three
+states:
+
+* cold: the index is empty and the paths are scanned
+* warm-disk: a new process would load the index from the cache file
+* warm-memory: the index of the current process is reused
+
+With ``--synthetic N`` an additional module path with N modules spread over
+nested directories is added, which resembles a host with collections
+installed.
+
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from ansible.plugins.loader import module_loader
+from suitable.module_index import ModuleIndex
+
+
+def create_synthetic_modules(root, count, per_directory=100):
+    for i in range(count):
+        directory = os.path.join(root, 'group{}'.format(i // per_directory))
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, 'module{}.py'.format(i)), 'w'):
+            pass
+
+
+def get_modules_from_path(path):
+    """ Lists the modules in the given path the way Suitable did before
+    the module index was introduced, as baseline.
+
+    """
+    blacklisted_extensions = ('.swp', '.bak', '~', '.rpm', '.pyc')
+    blacklisted_prefixes = ('_', )
+
+    assert os.path.isdir(path)
+
+    subpaths = list((os.path.join(path, p), p) for p in os.listdir(path))
+
+    for path, name in subpaths:
+        if name.endswith(blacklisted_extensions):
+            continue
+        if name.startswith(blacklisted_prefixes):
+            continue
+        if os.path.isdir(path):
+            for module in get_modules_from_path(path):
+                yield module
+        else:
+            yield os.path.splitext(name)[0]
+
+
+def scan(paths):
+    modules = set()
+
+    for path in (p for p in paths if os.path.isdir(p)):
+        modules.update(get_modules_from_path(path))
+
+    return modules
+
+
+def report(name, seconds, number):
+    print('{:<12} {:>10.3f} ms'.format(name, seconds / number * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synthetic', type=int, default=0)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        paths = list(module_loader._get_paths())
+
+        if args.synthetic:
+            synthetic = os.path.join(tempdir, 'modules')
+            create_synthetic_modules(synthetic, args.synthetic)
+            paths.append(synthetic)
+
+        cache_file = os.path.join(tempdir, 'modules.json')
+        ModuleIndex(cache_file).modules(paths)
+
+        warm = ModuleIndex()
+        warm.modules(paths)
+
+        print('{} modules in {} paths'.format(len(scan(paths)), len(paths)))
+
+        number = args.number
+
+        report('scan', timeit.timeit(lambda: scan(paths), number=number),
+               number)
+        report('cold', timeit.timeit(
+            lambda: ModuleIndex().modules(paths), number=number), number)
+        report('warm-disk', timeit.timeit(
+            lambda: ModuleIndex(cache_file).modules(paths), number=number),
+            number)
+        report('warm-memory', timeit.timeit(
+            lambda: warm.modules(paths), number=number), number)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
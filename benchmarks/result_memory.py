@@ -0,0 +1,107 @@
+""" Compares the peak memory used by the results of a module call with
+different result retention settings.
+
+    python benchmarks/result_memory.py [--hosts 1000] [--output 262144]
+
+Feeds a synthetic result set through the callback which collects the
+results of a call, the way Ansible reports them, and then builds the
+:class:`RunnerResults`. Each host returns ``--output`` characters of
+``stdout`` (plus ``stdout_lines``), similar to a command listing logs.
+
+Peak memory is measured using :mod:`tracemalloc` and only covers the
+results, not Ansible itself.
+
+"""
+import argparse
+import gc
+import shutil
+import tempfile
+import tracemalloc
+
+from collections import namedtuple
+from suitable.callback import SilentCallbackModule
+from suitable.module_runner import ModuleRunner
+from suitable.retention import ResultRetention
+
+
+Host = namedtuple('Host', ('name', ))
+
+
+class TaskResult(object):
+    """ Mimics the task results passed to the callback by Ansible. """
+
+    def __init__(self, host, result):
+        self._host = Host(host)
+        self._result = result
+
+
+def task_results(hosts, output):
+    line = 'x' * 79 + '\n'
+    stdout = (line * (output // len(line) + 1))[:output]
+
+    for i in range(hosts):
+
+        # each host returns output of its own
+        host_stdout = 'host{}\n'.format(i) + stdout
+
+        yield TaskResult('host{}'.format(i), {
+            'cmd': 'cat /var/log/syslog',
+            'rc': 0,
+            'changed': True,
+            'stdout': host_stdout,
+            'stdout_lines': host_stdout.splitlines(),
+            'stderr': '',
+            'stderr_lines': [],
+        })
+
+
+def measure(retention, hosts, output):
+    gc.collect()
+    tracemalloc.start()
+
+    callback = SilentCallbackModule(retention)
+
+    for result in task_results(hosts, output):
+        callback.v2_runner_on_ok(result)
+
+    results = ModuleRunner('command').collect_results(callback)
+    assert len(results['contacted']) == hosts
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--output', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        scenarios = (
+            ('keep all', None),
+            ('drop lines', ResultRetention(drop_lines=True)),
+            ('keys', ResultRetention(keys=('stdout', ))),
+            ('truncate 4k', ResultRetention(
+                drop_lines=True, max_output=4096)),
+            ('spill 4k', ResultRetention(
+                drop_lines=True, spill_threshold=4096,
+                spill_directory=tempdir)),
+        )
+
+        print('{} hosts with {} characters of output each'.format(
+            args.hosts, args.output))
+
+        for name, retention in scenarios:
+            peak = measure(retention, args.hosts, args.output)
+            print('{:<12} {:>10.1f} MiB'.format(name, peak / 1024 / 1024))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
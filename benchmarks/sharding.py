@@ -0,0 +1,54 @@
+""" Compares running a module against many hosts in a single process with
+running it in shards.
+
+    python benchmarks/sharding.py [--hosts 500] [--shards 4]
+
+The hosts are aliases of localhost, reached through the local connection,
+so the benchmark does not need any servers. Sharding pays off on machines
+with multiple cores, where the shard processes run in parallel.
+
+"""
+import argparse
+import time
+
+from suitable.api import Api
+
+
+def local_hosts(count):
+    return {
+        'host{}'.format(i): {'ansible_connection': 'local'}
+        for i in range(count)
+    }
+
+
+def measure(hosts, shards):
+    api = Api(local_hosts(hosts), shards=shards, lazy=True)
+
+    start = time.monotonic()
+    result = api.ping()
+    seconds = time.monotonic() - start
+
+    assert len(result['contacted']) == hosts
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=500)
+    parser.add_argument('--shards', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{} hosts'.format(args.hosts))
+
+    scenarios = (
+        ('unsharded', None),
+        ('{} shards'.format(args.shards), args.shards),
+    )
+
+    for name, shards in scenarios:
+        seconds = measure(args.hosts, shards)
+        print('{:<12} {:>8.2f} s'.format(name, seconds))
+
+
+if __name__ == '__main__':
+    main()
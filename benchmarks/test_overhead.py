@@ -0,0 +1,113 @@
+""" Measures the overhead of Suitable itself, using local connections to
+aliases of localhost, so no network is involved::
+
+    pytest benchmarks --benchmark-only [--max-hosts 1000]
+
+Calls against more than 100 hosts are skipped by default, as they take
+minutes on small machines.
+
+"""
+import gc
+import pytest
+import subprocess  # nosec
+import sys
+import tracemalloc
+
+from suitable.api import Api
+from suitable.callback import SilentCallbackModule
+
+
+ROUNDS = {1: 10, 10: 5, 100: 3, 1000: 1}
+
+
+def import_time(statement):
+    """ Returns the microseconds spent on the imports of the given
+    statement in a new interpreter, as reported by ``-X importtime``.
+
+    """
+    output = subprocess.run(  # nosec
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True
+    ).stderr
+
+    # import time: self [us] | cumulative | imported package
+    return sum(
+        int(line.split('|')[0].split(':')[1])
+        for line in output.splitlines()
+        if line.startswith('import time:') and 'self' not in line
+    )
+
+
+@pytest.mark.parametrize('statement', (
+    'import suitable',
+    'from suitable import Api',
+))
+def test_import(benchmark, statement):
+    benchmark.extra_info['import_time'] = import_time(statement)
+    benchmark.pedantic(import_time, (statement, ), rounds=3)
+
+
+@pytest.mark.parametrize('lazy', (True, False), ids=('lazy', 'eager'))
+def test_api_construction(benchmark, lazy):
+    Api('localhost', lazy=lazy)  # warm up the module index
+    benchmark(Api, 'localhost', lazy=lazy)
+
+
+@pytest.mark.parametrize('hosts', (1, 10, 100, 1000))
+def test_call(benchmark, local_hosts, hosts):
+    spans = []
+
+    api = Api(local_hosts(hosts), lazy=True, instrumentation=[spans.append])
+    benchmark.pedantic(api.ping, rounds=ROUNDS[hosts], warmup_rounds=1)
+
+    # what the call spent outside of Ansible's play
+    calls = [s.duration for s in spans if s.name == 'suitable.call']
+    runs = [s.duration for s in spans if s.name == 'suitable.run']
+
+    benchmark.extra_info['overhead'] = (sum(calls) - sum(runs)) / len(calls)
+
+
+@pytest.mark.parametrize('hosts', (10, 100, 1000, 10000))
+def test_evaluate_results(benchmark, task_results, hosts):
+    callback = SilentCallbackModule()
+
+    for result in task_results(hosts):
+        callback.v2_runner_on_ok(result)
+
+    api = Api({'host{}'.format(i): {} for i in range(hosts)}, lazy=True)
+    results = benchmark(api.command.evaluate_results, callback)
+
+    assert len(results['contacted']) == hosts
+
+
+@pytest.mark.parametrize('hosts', (10, 100, 1000))
+def test_memory_per_host(benchmark, task_results, hosts):
+    inventory = {
+        'host{}'.format(i): {'ansible_connection': 'local'}
+        for i in range(hosts)
+    }
+
+    def call():
+        api = Api(inventory, lazy=True)
+
+        # the inventory Ansible sees, as prepared for each call
+        api.get_execution_context().prepare()
+
+        callback = SilentCallbackModule()
+
+        for result in task_results(hosts):
+            callback.v2_runner_on_ok(result)
+
+        return api, api.command.evaluate_results(callback)
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    benchmark.extra_info['memory_per_host'] = peak // hosts
+    benchmark(call)
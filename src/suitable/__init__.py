@@ -1,9 +1,25 @@
-import __main__
+import importlib
 
-from ansible.utils.display import Display
-__main__.display = Display()
+# Ansible takes a while to import, so the public api is only imported once
+# it is used, which keeps 'import suitable' cheap
+__all__ = ('Api', 'enable_module_cache', 'install_strategy_plugins')
 
-from suitable.api import Api  # noqa
-from suitable.api import install_strategy_plugins  # noqa
 
-__all__ = ('Api', 'install_strategy_plugins')
+def __getattr__(name):
+    if name in __all__:
+        return getattr(importlib.import_module('suitable.api'), name)
+
+    # submodules used to be imported along with the package
+    if not name.startswith('_'):
+        try:
+            return importlib.import_module('suitable.' + name)
+        except ModuleNotFoundError as e:
+            if e.name != 'suitable.' + name:
+                raise
+
+    raise AttributeError(
+        "module 'suitable' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,16 +1,31 @@
 import logging
-import os
+import threading
 
 from ansible import constants as C
 from ansible.plugins.loader import module_loader
 from ansible.plugins.loader import strategy_loader
+from concurrent.futures import ThreadPoolExecutor, wait
 from contextlib import contextmanager
+from suitable.batch import Batch, Pipeline
+from suitable.connection_pool import ConnectionPool
 from suitable.errors import UnreachableError, ModuleError
+from suitable.execution_context import ExecutionContext
+from suitable.facts import FactsCache
+from suitable.forks import ForkPolicy
+from suitable.instrumentation import Instrumentation
+from suitable.memoization import Memoization
+from suitable.module_index import ModuleIndex, default_cache_file
 from suitable.module_runner import ModuleRunner
+from suitable.retry import HostHealth, RetryPolicy
+from suitable.sharding import ShardedExecutionContext
 from suitable.utils import options_as_class
 from suitable.inventory import Inventory
 
 
+# the module index is shared by all Api instances in the process
+MODULE_INDEX = ModuleIndex()
+
+
 VERBOSITY = {
     'critical': logging.CRITICAL,
     'error': logging.ERROR,
@@ -27,8 +42,22 @@ class Api(object):
         api = Api('personal.server.dev')
         api.sync(src='/Users/denis/.zshrc', dest='/home/denis/.zshrc')
 
+    Api instances may be used from multiple threads. Module calls of
+    different apis run in parallel, calls of the same api one after the
+    other (unless the api is isolated, or the calls are made through
+    ``submit``). The settings which Ansible keeps globally (host key
+    checking, verbosity and the options passed to the api) are only
+    applied while a call is running. Calls that require different settings
+    take turns, calls with the same settings share them.
+
+    :meth:`valid_return_codes` and :meth:`batch` only apply to calls made
+    from the same thread.
+
     """
 
+    # the class hooking up each Ansible module
+    runner_class = ModuleRunner
+
     def __init__(
         self, servers,
         ignore_unreachable=False,
@@ -39,6 +68,20 @@ class Api(object):
         verbosity='info',
         environment=None,
         strategy=None,
+        lazy=False,
+        isolated=False,
+        persistent=False,
+        connection_pool=None,
+        result_retention=None,
+        shards=None,
+        forks=None,
+        instrumentation=None,
+        facts_cache=None,
+        memoization=None,
+        max_workers=None,
+        timeout=None,
+        retry=None,
+        health=None,
         **options
     ):
         """
@@ -47,7 +90,8 @@ class Api(object):
             with server name as key and ansible host variables as values. The
             api instances will operate on these servers only. Servers which
             cannot be reached or whose use triggers an error are taken out
-            of the list for the lifetime of the object.
+            of the list for the lifetime of the object (see ``health``
+            for an alternative).
 
             Examples of valid uses::
 
@@ -122,6 +166,149 @@ class Api(object):
         :param host_key_checking:
             Set to false to disable host key checking.
 
+        :param lazy:
+            If true, Ansible modules are not hooked up when the api is
+            created. Instead, each module is looked up through Ansible's
+            module loader on first access and cached on the instance::
+
+                api = Api('example.org', lazy=True)
+                api.command('whoami')  # 'command' is resolved here
+
+            This makes creating an api instance cheap, regardless of the
+            number of installed modules and collections.
+
+        :param isolated:
+            By default, the Ansible inventory and variable manager are built
+            once and then reused for all module calls of the api. Changes to
+            :attr:`inventory` are applied incrementally before each call.
+
+            If true, these are built from scratch for each module call
+            instead, which is slower but ensures that no Ansible state
+            is shared between calls.
+
+        :param persistent:
+            If true, the Ansible task queue manager is kept alive between
+            module calls, instead of being set up and torn down for each
+            call. It is shut down when :meth:`close` is called, or when
+            the api is used as a context manager::
+
+                with Api('example.org', persistent=True) as api:
+                    api.command('uptime')
+                    api.command('whoami')
+
+            Cannot be combined with ``isolated``.
+
+        :param connection_pool:
+            Set to true, or pass a ``ConnectionPool`` instance from
+            :mod:`suitable.connection_pool`, to keep SSH connections open
+            between module calls::
+
+                pool = ConnectionPool(idle_timeout=300, max_size=100)
+                api = Api(servers, connection_pool=pool)
+
+                api.command('uptime')
+                api.command('whoami')
+
+                assert pool.hits == len(servers)
+
+            The connections are closed by :meth:`close`. Only applies to
+            the ``ssh`` and ``smart`` connections.
+
+        :param result_retention:
+            A ``ResultRetention`` instance from :mod:`suitable.retention`,
+            which limits how much of the results is kept in memory (e.g. by
+            truncating the output or spilling it to disk)::
+
+                api = Api(servers, result_retention=ResultRetention(
+                    keys=('stdout', ), max_output=1024 * 1024))
+
+            By default, the results are kept as returned by Ansible.
+
+        :param shards:
+            Splits the inventory into the given number of shards, and runs
+            the play of each shard in a separate process (see
+            :mod:`suitable.sharding`). Useful for inventories with thousands
+            of hosts, where aggregating the results in a single process
+            becomes the bottleneck.
+
+            Cannot be combined with ``persistent``.
+
+        :param forks:
+            The number of hosts Ansible works on in parallel. By default,
+            the number is picked for each call, depending on the number of
+            hosts, the available resources and the timings of previous
+            calls (see :class:`suitable.forks.ForkPolicy`), up to the number
+            of forks configured for Ansible, if any.
+
+            Pass a number to use a fixed number of forks, or a
+            ``ForkPolicy`` instance to customise the policy::
+
+                api = Api(servers, forks=ForkPolicy(minimum=10))
+                api.command('uptime')
+
+                print(api.fork_policy.forks, api.fork_policy.latency)
+
+        :param instrumentation:
+            A list of hooks, which receive the timings of each module call
+            (see :class:`suitable.instrumentation.Instrumentation`). More
+            hooks may be added later::
+
+                api.instrumentation.add(hook)
+
+        :param facts_cache:
+            Set to true, or pass a ``FactsCache`` instance from
+            :mod:`suitable.facts`, to keep the facts returned by
+            :meth:`facts` around, and to provide them as host variables to
+            all module calls.
+
+        :param memoization:
+            Set to true, or pass a ``Memoization`` instance from
+            :mod:`suitable.memoization`, to serve repeated calls of
+            read-only modules (like ``stat`` or ``getent``) from memory::
+
+                api = Api(servers, memoization=Memoization(
+                    ttl=30, modules=('stat', 'command')))
+
+        :param max_workers:
+            The maximum number of module calls submitted through
+            ``submit`` (e.g. ``api.command.submit('uptime')``), which run
+            at the same time. Defaults to the default of
+            :class:`concurrent.futures.ThreadPoolExecutor`.
+
+        :param timeout:
+            The number of seconds after which module calls stop waiting for
+            the servers. Servers without result by then are listed in the
+            ``timed_out`` results and passed to :meth:`on_host_timeout`::
+
+                api = Api(servers, timeout=10)
+                result = api.command('uptime')
+
+                for server in result['timed_out']:
+                    print(server, 'is slow')
+
+            The timeout may be set for a single call as well::
+
+                api.command('uptime', _timeout=5)
+
+            Calls in batches and pipelines are not limited.
+
+        :param retry:
+            A ``RetryPolicy`` instance from :mod:`suitable.retry`, or the
+            number of attempts, to re-run module calls on servers which
+            could not be reached, waiting longer after each attempt::
+
+                api = Api(servers, retry=RetryPolicy(attempts=3, backoff=1))
+
+            Only the unreachable servers are run again, in the same call.
+            The timeout applies to each attempt.
+
+        :param health:
+            Set to true, or pass a ``HostHealth`` instance from
+            :mod:`suitable.retry`, to quarantine servers which repeatedly
+            could not be reached, or whose use triggered an error, for a
+            cooldown period. By default, such servers are taken out of the
+            list for the lifetime of the object.
+
         :param extra_vars:
 
             Extra variables available to Ansible. Note that those will be
@@ -162,6 +349,11 @@ class Api(object):
         """
         options['module_path'] = None
 
+        # the forks are picked for each call, this is only a fallback for
+        # the 'ansible_forks' variable
+        if isinstance(forks, int):
+            options['forks'] = forks
+
         # load all the other defaults required by ansible
         # the following are available as constants:
         required_defaults = (
@@ -199,20 +391,293 @@ class Api(object):
                 )
             }
 
+        # state which only applies to the current thread
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
         # keep host_key_checking around for the runner
         self.host_key_checking = host_key_checking
 
         self.options = options_as_class(options)
-        self._valid_return_codes = (0, )
 
         self.ignore_unreachable = ignore_unreachable
         self.ignore_errors = ignore_errors
 
         self.environment = environment or {}
         self.strategy = strategy
+        self.lazy = lazy
+        self.isolated = isolated
+        self.persistent = persistent
+
+        assert not (isolated and persistent), """
+            An api cannot be isolated and persistent at the same time.
+        """
+
+        self.shards = shards
+
+        assert not (shards and persistent), """
+            An api cannot be sharded and persistent at the same time.
+        """
+
+        if connection_pool is True:
+            connection_pool = ConnectionPool()
+        elif connection_pool is False:
+            connection_pool = None
+
+        self.connection_pool = connection_pool
+        self.result_retention = result_retention
+
+        if forks is None:
+            forks = ForkPolicy()
+        elif isinstance(forks, int):
+            forks = ForkPolicy(minimum=forks, maximum=forks)
+
+        self.fork_policy = forks
+        self.instrumentation = Instrumentation(instrumentation or ())
+
+        if facts_cache is True:
+            facts_cache = FactsCache()
+        elif facts_cache is False:
+            facts_cache = None
+
+        self.facts_cache = facts_cache
+
+        if memoization is True:
+            memoization = Memoization()
+        elif memoization is False:
+            memoization = None
+
+        self.memoization = memoization
+
+        self.timeout = timeout
+
+        if retry is True:
+            retry = RetryPolicy()
+        elif retry is False:
+            retry = None
+        elif isinstance(retry, int):
+            retry = RetryPolicy(attempts=retry)
+
+        self.retry = retry
+
+        if health is True:
+            health = HostHealth()
+        elif health is False:
+            health = None
+
+        self.health = health
+
+        # started on demand by submit
+        self.max_workers = max_workers
+        self._executor = None
+        self._execution_context = ExecutionContext(self)
+
+        if not lazy:
+            for module in list_ansible_modules():
+                self.runner_class(module).hookup(self)
+
+    def __getattr__(self, name):
+        # only called if the attribute could not be found, which in lazy
+        # mode means that the module has not been hooked up yet
+        if name.startswith('_') or not self.__dict__.get('lazy'):
+            raise AttributeError(name)
+
+        if not module_loader.has_plugin(name):
+            raise AttributeError(name)
+
+        # another thread might have hooked up the module in the meantime
+        with self._lock:
+            if name not in self.__dict__:
+                self.runner_class(name).hookup(self)
+
+        return self.__dict__[name]
+
+    @property
+    def _valid_return_codes(self):
+        return getattr(self._local, 'valid_return_codes', (0, ))
+
+    @_valid_return_codes.setter
+    def _valid_return_codes(self, codes):
+        self._local.valid_return_codes = codes
+
+    @property
+    def _batch(self):
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Releases the resources kept alive between module calls. The api
+        may still be used afterwards, though persistent resources will be
+        set up again.
+
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        # submitted calls are finished first, they might use the resources
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        self._execution_context.close()
+
+        if self.connection_pool is not None:
+            self.connection_pool.close()
+
+    def get_execution_context(self):
+        """ Returns the context in which module calls are executed. Unless
+        the api is isolated, the same context is returned each time.
+
+        """
+        if self.shards:
+            return ShardedExecutionContext(self, self.shards)
+
+        if self.isolated:
+            return ExecutionContext(self)
+
+        return self._execution_context
+
+    def submit(self, function, *args, **kwargs):
+        """ Runs the given function in the executor of the api and returns
+        a :class:`concurrent.futures.Future`. See :meth:`ModuleRunner.submit`
+        for running modules this way.
 
-        for runner in (ModuleRunner(m) for m in list_ansible_modules()):
-            runner.hookup(self)
+        The executor is a thread pool, started on first use and shut down by
+        :meth:`close`. Pass ``max_workers`` to the api to limit the number
+        of calls running at the same time.
+
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='suitable-submit'
+                )
+
+            return self._executor.submit(function, *args, **kwargs)
+
+    def gather(self, *futures, return_exceptions=False):
+        """ Waits for the given futures and returns their results, in the
+        order of the futures::
+
+            uptime, whoami = api.gather(
+                api.command.submit('uptime'),
+                api.command.submit('whoami')
+            )
+
+        If a call failed, the first error is raised once all calls are
+        done, unless ``return_exceptions`` is true, in which case errors
+        are returned in place of the results.
+
+        """
+        wait(futures)
+
+        results = []
+
+        for future in futures:
+            error = future.exception()
+
+            if error is not None and not return_exceptions:
+                raise error
+
+            results.append(future.result() if error is None else error)
+
+        return results
+
+    def resolve_servers(self, servers):
+        """ Returns the servers matching the given patterns (a list or a
+        string with space-delimited patterns) as a list. See
+        :meth:`suitable.inventory.Inventory.select` for the patterns.
+
+        """
+        if isinstance(servers, str):
+            servers = servers.split(u' ')
+
+        selected = {}
+
+        for pattern in servers:
+            for server in self.inventory.select(pattern):
+                selected[server] = True
+
+        return list(selected)
+
+    def on(self, servers):
+        """ Returns a view of the api, whose module calls are limited to
+        the given servers, groups or patterns::
+
+            api = Api(['web.example.org', 'db.example.org'])
+            api.on('db.example.org').service(name='postgresql')
+            api.on('web*').service(name='nginx')
+
+        Alternatively, the servers may be passed to a single call::
+
+            api.command('uptime', _hosts=['web.example.org'])
+
+        The api, its settings and its modules are shared with the view. Only
+        the given servers are added to the Ansible inventory, if they are
+        not in it already.
+
+        """
+        return ServerSubset(self, self.resolve_servers(servers))
+
+    def facts(self, server=None, refresh=False):
+        """ Returns the facts of the given server, or a dict with the facts
+        of all servers if no server is given::
+
+            api.facts('example.org')['ansible_distribution']
+
+        Facts are gathered using the ``setup`` module, which only runs on
+        the servers without fresh facts in the facts cache (or on all
+        servers, if ``refresh`` is true). Without facts cache, the facts are
+        gathered each time.
+
+        Servers which could not be reached are left out (if unreachable
+        servers are ignored).
+
+        """
+        assert self._batch is None, "facts cannot be gathered in a batch"
+
+        if server is not None and server not in self.inventory:
+            raise KeyError("{} is not in the inventory".format(server))
+
+        servers = list(self.inventory) if server is None else [server]
+        cache = self.facts_cache
+
+        if cache is None or refresh:
+            stale = servers
+        else:
+            stale = cache.stale(servers)
+
+        facts = {}
+
+        if stale:
+            setup = ModuleRunner('setup')
+            setup.api = self
+
+            result = setup.for_call({}, hosts=stale).run()
+
+            for host, host_result in result['contacted'].items():
+                if 'ansible_facts' in host_result:
+                    facts[host] = host_result['ansible_facts']
+
+            if cache is not None:
+                cache.update(facts)
+
+        if cache is not None:
+            facts = dict(cache.fresh(servers), **facts)
+
+        if server is not None:
+            return facts.get(server)
+
+        return facts
 
     def on_unreachable_host(self, module, host):
         """ If you want to customize your error handling, this would be
@@ -244,6 +709,20 @@ class Api(object):
         """
         raise ModuleError(module, host, result)
 
+    def on_host_timeout(self, module, host, timeout):
+        """ Called for each host which did not finish a module call
+        within the timeout. If you want to customize your error handling,
+        this would be the point to write your own method in a subclass.
+
+        By default, the host is kept and the results of the other hosts are
+        returned. Raise an error (e.g.
+        :class:`suitable.errors.HostTimeoutError`) to abort the call, or
+        return anything but 'keep-trying' to ignore the host for the
+        lifetime of the object.
+
+        """
+        return 'keep-trying'
+
     def is_valid_return_code(self, code):
         return code in self._valid_return_codes
 
@@ -261,9 +740,86 @@ class Api(object):
         previous_codes = self._valid_return_codes
         self._valid_return_codes = codes
 
-        yield
+        try:
+            yield
+        finally:
+            self._valid_return_codes = previous_codes
+
+    def batch(self):
+        """ Collects the module calls made inside the context and runs them
+        as tasks of a single Ansible play when the context is left::
+
+            with api.batch() as batch:
+                api.copy(src='nginx.conf', dest='/etc/nginx/nginx.conf')
+                api.service(name='nginx', state='restarted')
+
+            copy_result, service_result = batch.results
+
+        Connections are set up once for the whole batch, instead of once
+        for each call. Inside the context, module calls return None. The
+        results are available afterwards, one per call.
+
+        Errors are handled like they would be for separate calls and the
+        valid return codes are those in effect at the time of each call.
+        Hosts which fail a task do not run the remaining tasks. If an
+        exception is raised inside the context, no task is run.
+
+        """
+        return self.collect_calls(Batch(self))
+
+    def pipeline(self):
+        """ Collects the module calls made inside the context like
+        :meth:`batch`, but runs them as a pipeline, through which each
+        host advances on its own, without waiting for the other hosts to
+        finish a task (using Ansible's ``free`` strategy)::
+
+            with api.pipeline() as pipeline:
+                api.copy(src='nginx.conf', dest='/etc/nginx/nginx.conf')
+                api.service(name='nginx', state='restarted')
+
+            copy_result, service_result = pipeline.results
+            copy, service = pipeline.host_results('web.example.org')
+
+        This way, slow hosts do not hold up the others. Results and errors
+        are handled like they are for batches.
+
+        The strategy of the api is not used for the pipeline, except for
+        Mitogen strategies, which are replaced by ``mitogen_free``.
+
+        """
+        return self.collect_calls(Pipeline(self))
+
+    @contextmanager
+    def collect_calls(self, batch):
+        assert self._batch is None, "batches cannot be nested"
+
+        self._batch = batch
 
-        self._valid_return_codes = previous_codes
+        try:
+            yield batch
+        finally:
+            self._batch = None
+
+        batch.run()
+
+
+class ServerSubset(object):
+    """ Provides the modules of an api, limited to a subset of its servers.
+    See :meth:`Api.on`.
+
+    """
+
+    def __init__(self, api, servers):
+        self.api = api
+        self.servers = servers
+
+    def __getattr__(self, name):
+        runner = getattr(self.api, name)
+
+        if not isinstance(runner, ModuleRunner):
+            raise AttributeError(name)
+
+        return runner.limit(self.servers)
 
 
 def install_strategy_plugins(directories):
@@ -286,35 +842,22 @@ def install_strategy_plugins(directories):
         strategy_loader.add_directory(directory)
 
 
-def list_ansible_modules():
-    # inspired by
-    # https://github.com/ansible/ansible/blob/devel/bin/ansible-doc
-
-    paths = (p for p in module_loader._get_paths() if os.path.isdir(p))
-
-    modules = set()
-
-    for path in paths:
-        modules.update(m for m in get_modules_from_path(path))
-
-    return modules
+def enable_module_cache(cache_file=None):
+    """ Persists the index of available Ansible modules to the given file,
+    or to ``~/.cache/suitable/modules.json`` if no file is given.
 
+    The modules are otherwise listed once per process. With the cache
+    enabled, short-lived processes may skip walking the module paths
+    entirely. The cache is invalidated automatically whenever the module
+    paths or the directories in them change.
 
-def get_modules_from_path(path):
-    blacklisted_extensions = ('.swp', '.bak', '~', '.rpm', '.pyc')
-    blacklisted_prefixes = ('_', )
+    Call this function before creating the first :class:`Api` instance.
 
-    assert os.path.isdir(path)
+    """
+    MODULE_INDEX.cache_file = cache_file or default_cache_file()
 
-    subpaths = list((os.path.join(path, p), p) for p in os.listdir(path))
 
-    for path, name in subpaths:
-        if name.endswith(blacklisted_extensions):
-            continue
-        if name.startswith(blacklisted_prefixes):
-            continue
-        if os.path.isdir(path):
-            for module in get_modules_from_path(path):
-                yield module
-        else:
-            yield os.path.splitext(name)[0]
+def list_ansible_modules():
+    # inspired by
+    # https://github.com/ansible/ansible/blob/devel/bin/ansible-doc
+    return set(MODULE_INDEX.modules(module_loader._get_paths()))
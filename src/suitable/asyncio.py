@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import asyncio
+
+from suitable.api import Api
+from suitable.module_runner import ModuleRunner
+
+
+class AsyncModuleRunner(ModuleRunner):
+    """ Runs Ansible modules like :class:`ModuleRunner`, but calls return
+    coroutines, which run the module in the executor of the api (see
+    :meth:`ModuleRunner.submit`).
+
+    """
+
+    def __call__(self, *args, **kwargs):
+        return self.execute_async(*args, **kwargs)
+
+    async def execute_async(self, *args, **kwargs):
+
+        # batched calls are only recorded, which does not block
+        if self.api._batch is not None:
+            return self.execute(*args, **kwargs)
+
+        return await asyncio.wrap_future(self.submit(*args, **kwargs))
+
+    async def stream(self, *args, **kwargs):
+        """ Runs the module like :meth:`ModuleRunner.stream`, as an
+        asynchronous iterator::
+
+            async for server, result in api.shell.stream('uptime'):
+                print(server, result.stdout())
+
+        """
+        results = super(AsyncModuleRunner, self).stream(*args, **kwargs)
+        done = object()
+
+        try:
+            while True:
+                item = await asyncio.wrap_future(
+                    self.api.submit(next, results, done))
+
+                if item is done:
+                    break
+
+                yield item
+        finally:
+            await asyncio.wrap_future(self.api.submit(results.close))
+
+
+class AsyncApi(Api):
+    """ Provides all available ansible modules as coroutine functions::
+
+        async def main():
+            web = AsyncApi('web.example.org')
+            db = AsyncApi('db.example.org')
+
+            await asyncio.gather(
+                web.service(name='nginx', state='restarted'),
+                db.service(name='postgresql', state='restarted')
+            )
+
+    The calls run in the executor of the api (see :meth:`Api.submit`), so
+    the event loop is not blocked. Calls run concurrently, including calls
+    of the same api (e.g. on different servers, through :meth:`Api.on`).
+    Ansible keeps some of its settings globally, so apis with different
+    settings (e.g. host key checking or become options) take turns.
+
+    """
+
+    runner_class = AsyncModuleRunner
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+
+        # closing the api waits for the calls still running
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -0,0 +1,153 @@
+import json
+
+from suitable.callback import BatchCallbackModule
+from suitable.common import log
+
+
+# the name under which the result of each batched task is registered
+REGISTER = '_suitable_result'
+
+
+class Batch(object):
+    """ Collects module calls made on an api and runs them as tasks of a
+    single Ansible play. See :meth:`suitable.api.Api.batch`.
+
+    """
+
+    # the Ansible strategy of the play, None for the one of the api
+    strategy = None
+
+    def __init__(self, api):
+        self.api = api
+        self.calls = []
+        self.results = None
+
+    def add(self, runner, module_args):
+        """ Records a module call, together with the settings that are
+        in effect at the time of the call.
+
+        """
+        self.calls.append({
+            'runner': runner,
+            'module_args': module_args,
+            'environment': dict(self.api.environment),
+            'valid_return_codes': tuple(self.api._valid_return_codes),
+        })
+
+    def get_task(self, index, call):
+        task = call['runner'].get_task(call['module_args'])
+        task['name'] = 'Suitable Task {}'.format(index)
+        task['environment'] = call['environment']
+
+        # Ansible stops running tasks on hosts which failed, so we have to
+        # tell it about return codes which we consider valid
+        task['register'] = REGISTER
+        task['failed_when'] = (
+            "({r}.failed | default(false)) and not "
+            "({r}.rc is defined and {r}.rc in {codes})"
+        ).format(r=REGISTER, codes=list(call['valid_return_codes']))
+
+        # calls limited to some hosts are skipped on the others
+        if call['runner'].hosts is not None:
+            task['when'] = 'inventory_hostname in {}'.format(
+                json.dumps(call['runner'].hosts))
+
+        # hosts are only taken out of the list if errors are not ignored
+        if self.api.ignore_errors:
+            task['ignore_errors'] = True
+
+        if self.api.ignore_unreachable:
+            task['ignore_unreachable'] = True
+
+        return task
+
+    def run(self):
+        """ Runs all collected calls in one play and evaluates the results
+        of each task, in the order in which the calls were made.
+
+        Error handling happens as if the calls had been made one after
+        another, except that all tasks are evaluated before the first
+        error is raised. Hosts failing a task do not run the remaining
+        tasks of the batch.
+
+        """
+        self.results = []
+
+        if not self.calls:
+            return self.results
+
+        tasks = [self.get_task(i, c) for i, c in enumerate(self.calls)]
+        callback = BatchCallbackModule(
+            [t['name'] for t in tasks], self.api.result_retention)
+
+        log.info(u'running batch of {} tasks'.format(len(tasks)))
+
+        instrumentation = self.api.instrumentation
+
+        with instrumentation.span('suitable.call', tasks=len(tasks)):
+            self.api.get_execution_context().run(
+                tasks, callback, strategy=self.strategy)
+
+            with instrumentation.span('suitable.evaluate'):
+                return self.evaluate(tasks, callback)
+
+    def evaluate(self, tasks, callback):
+        """ Evaluates the results of each task, keeping the first error
+        until all tasks are evaluated.
+
+        """
+        error = None
+
+        for task, call in zip(tasks, self.calls):
+            runner = call['runner']
+            task_callback = callback.tasks[task['name']]
+
+            try:
+                with self.api.valid_return_codes(*call['valid_return_codes']):
+                    result = runner.evaluate_results(task_callback)
+            except Exception as e:
+                result = runner.collect_results(task_callback)
+                error = error or e
+
+            self.results.append(result)
+
+        if error is not None:
+            raise error
+
+        return self.results
+
+
+class Pipeline(Batch):
+    """ Runs the collected calls like :class:`Batch`, but each host
+    advances through the tasks on its own. See
+    :meth:`suitable.api.Api.pipeline`.
+
+    """
+
+    @property
+    def strategy(self):
+        # Mitogen comes with a free strategy of its own
+        if (self.api.strategy or '').startswith('mitogen_'):
+            return 'mitogen_free'
+
+        return 'free'
+
+    def host_results(self, server):
+        """ Returns the results of the given server, one per call. Calls
+        the server did not get to (e.g. because a previous call failed) are
+        None.
+
+        """
+        assert self.results is not None, "the pipeline has not run yet"
+
+        results = []
+
+        for result in self.results:
+            if server in result['contacted']:
+                results.append(result['contacted'][server])
+            elif server in result['unreachable']:
+                results.append(result['unreachable'][server])
+            else:
+                results.append(None)
+
+        return results
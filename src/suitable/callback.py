@@ -1,27 +1,157 @@
 from ansible.plugins.callback import CallbackBase
 
 
+def retain(retention, result):
+    """ Applies the given :class:`suitable.retention.ResultRetention` to
+    the result, if any.
+
+    """
+    if retention is None:
+        return result
+
+    return retention.apply(result)
+
+
 class SilentCallbackModule(CallbackBase):
     """ A callback module that does not print anything, but keeps tabs
     on what's happening in an Ansible play.
 
     """
 
-    def __init__(self):
+    def __init__(self, retention=None):
         self.unreachable = {}
         self.contacted = {}
+        self.retention = retention
+
+        # hosts without result when the play was stopped, filled in by the
+        # module runner
+        self.timed_out = {}
 
     def v2_runner_on_ok(self, result):
         self.contacted[result._host.name] = {
             'success': True,
-            'result': result._result
+            'result': retain(self.retention, result._result)
         }
 
     def v2_runner_on_failed(self, result, ignore_errors=False):
         self.contacted[result._host.name] = {
             'success': False,
-            'result': result._result
+            'result': retain(self.retention, result._result)
         }
 
     def v2_runner_on_unreachable(self, result):
         self.unreachable[result._host.name] = result._result
+
+
+class BatchCallbackModule(CallbackBase):
+    """ A callback module that keeps tabs on a play with multiple tasks,
+    by handing the results of each task to a separate
+    :class:`SilentCallbackModule`. Tasks are identified by name.
+
+    """
+
+    def __init__(self, names, retention=None):
+        self.tasks = {name: SilentCallbackModule(retention) for name in names}
+
+    def v2_runner_on_ok(self, result):
+        self.tasks[result._task.get_name()].v2_runner_on_ok(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.tasks[result._task.get_name()].v2_runner_on_failed(
+            result, ignore_errors)
+
+    def v2_runner_on_unreachable(self, result):
+        self.tasks[result._task.get_name()].v2_runner_on_unreachable(result)
+
+
+class StreamingCallbackModule(CallbackBase):
+    """ A callback module that does not keep any results, but hands them to
+    the given queue as they come in, as tuples of event, server and result.
+
+    The events are 'contacted' and 'unreachable'.
+
+    """
+
+    def __init__(self, events, retention=None):
+        self.events = events
+        self.retention = retention
+
+    def v2_runner_on_ok(self, result):
+        self.events.put(('contacted', result._host.name, {
+            'success': True,
+            'result': retain(self.retention, result._result)
+        }))
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.events.put(('contacted', result._host.name, {
+            'success': False,
+            'result': retain(self.retention, result._result)
+        }))
+
+    def v2_runner_on_unreachable(self, result):
+        self.events.put(('unreachable', result._host.name, result._result))
+
+
+class RecordingCallbackModule(CallbackBase):
+    """ A callback module that records the events of a play, so they can
+    be replayed to another callback module (possibly in another process),
+    using :func:`replay`.
+
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, event, result):
+        self.events.append((
+            event, result._host.name, result._task.get_name(), result._result
+        ))
+
+    def v2_runner_on_ok(self, result):
+        self.record('v2_runner_on_ok', result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.record('v2_runner_on_failed', result)
+
+    def v2_runner_on_unreachable(self, result):
+        self.record('v2_runner_on_unreachable', result)
+
+
+class ReplayedHost(object):
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+
+class ReplayedTask(object):
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class ReplayedResult(object):
+    """ Stands in for the task results of Ansible when replaying events.
+    Only provides what the callback modules of Suitable use.
+
+    """
+
+    __slots__ = ('_host', '_task', '_result')
+
+    def __init__(self, host, task, result):
+        self._host = ReplayedHost(host)
+        self._task = ReplayedTask(task)
+        self._result = result
+
+
+def replay(events, callback):
+    """ Replays the events recorded by :class:`RecordingCallbackModule` to
+    the given callback module.
+
+    """
+    for event, host, task, result in events:
+        getattr(callback, event)(ReplayedResult(host, task, result))
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess  # nosec
+import tempfile
+import time
+
+from collections import OrderedDict
+from suitable.common import log
+
+
+# connection plugins which are pooled through OpenSSH's ControlMaster
+POOLED_CONNECTIONS = ('ssh', 'smart')
+
+# the ssh options set by the pool, replacing those configured for Ansible
+POOL_OPTIONS = ('controlmaster', 'controlpersist')
+
+
+def configured_ssh_args():
+    """ Returns the ssh_args configured for Ansible's ssh connection plugin
+    (e.g. through ansible.cfg or ``ANSIBLE_SSH_ARGS``).
+
+    """
+    from ansible import constants as C
+    from ansible.plugins.loader import connection_loader
+
+    # the options of the plugin are only known once it is loaded
+    connection_loader.get('ssh', class_only=True)
+
+    return C.config.get_config_value(
+        'ssh_args', plugin_type='connection', plugin_name='ssh') or ''
+
+
+def without_pool_options(args):
+    """ Returns the given ssh arguments (a list) without the options the
+    pool sets by itself.
+
+    """
+    result = []
+    skip = False
+
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+            continue
+
+        if arg == '-o' and i + 1 < len(args):
+            option = args[i + 1]
+            skip = True
+        elif arg.startswith('-o'):
+            option = arg[2:]
+        else:
+            result.append(arg)
+            continue
+
+        if option.split('=', 1)[0].strip().lower() in POOL_OPTIONS:
+            continue
+
+        result.extend(('-o', option))
+
+    return result
+
+
+class ConnectionPool(object):
+    """ Keeps SSH connections open between module calls.
+
+    Ansible forks a new worker for each host and task, so connections
+    cannot be kept in the process. Instead, the pool has OpenSSH multiplex
+    all sessions to a host over a master connection (``ControlMaster``),
+    which lives on in the background until it has been idle for
+    ``idle_timeout`` seconds. The ``ssh_args`` configured for Ansible
+    are kept, apart from their ControlMaster and ControlPersist options.
+
+    Connections are keyed by host, port, user and become settings. If
+    ``max_size`` is given, the least recently used connections are closed
+    once more connections are open.
+
+    The pool only applies to the ``ssh`` and ``smart`` connection plugins.
+    Connections through ``paramiko`` cannot outlive the worker which
+    opened them and are not pooled.
+
+    """
+
+    def __init__(self, idle_timeout=60, max_size=None, directory=None):
+        self.idle_timeout = idle_timeout
+        self.max_size = max_size
+        self.directory = directory
+
+        # key -> time of last use, least recently used first
+        self.connections = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._owns_directory = directory is None
+        self._ssh_args = None
+
+    def __len__(self):
+        return len(self.connections)
+
+    def get_directory(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='suitable-cp-')
+
+        # the directory is recreated after closing the pool, as the control
+        # paths might still be referenced by host variables
+        elif not os.path.isdir(self.directory):
+            os.makedirs(self.directory, mode=0o700)
+
+        return self.directory
+
+    def key(self, api, host, host_variables):
+        """ Returns the key of the connection to the given host, or None if
+        the connection is not pooled.
+
+        """
+        connection = host_variables.get(
+            'ansible_connection', api.options.connection)
+
+        if connection not in POOLED_CONNECTIONS:
+            return None
+
+        return (
+            host_variables.get('ansible_host', host),
+            host_variables.get('ansible_port'),
+            host_variables.get('ansible_user', api.options.remote_user),
+            bool(host_variables.get('ansible_become', api.options.become)),
+        )
+
+    def control_path(self, key):
+        # unix sockets paths are limited to ~100 characters
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.get_directory(), digest)
+
+    def ssh_args(self):
+        """ Returns the ssh arguments of pooled connections: the configured
+        ones, with the pool's ControlMaster and ControlPersist options.
+
+        """
+        if self._ssh_args is None:
+            args = without_pool_options(shlex.split(configured_ssh_args()))
+            args.extend((
+                '-o', 'ControlMaster=auto',
+                '-o', 'ControlPersist={}s'.format(self.idle_timeout),
+            ))
+
+            self._ssh_args = ' '.join(shlex.quote(arg) for arg in args)
+
+        return self._ssh_args
+
+    def host_variables(self, key):
+        """ Returns the Ansible variables which make the ssh connection
+        plugin use the pooled master connection.
+
+        """
+        return {
+            'ansible_ssh_args': self.ssh_args(),
+            'ansible_control_path': self.control_path(key),
+        }
+
+    def is_open(self, key):
+        if key not in self.connections:
+            return False
+
+        if time.monotonic() - self.connections[key] > self.idle_timeout:
+            return False
+
+        return os.path.exists(self.control_path(key))
+
+    def checkout(self, keys):
+        """ Marks the given connections as used, counting each connection
+        which is still open as hit and the others as miss.
+
+        """
+        now = time.monotonic()
+        self.get_directory()
+
+        for key in keys:
+            if self.is_open(key):
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            self.connections[key] = now
+            self.connections.move_to_end(key)
+
+    def merge(self, connections, hits, misses):
+        """ Adds the connections used by a copy of the pool (e.g. in a shard
+        process), together with the hits and misses counted by the copy.
+
+        """
+        for key, used in connections.items():
+            if key not in self.connections or self.connections[key] < used:
+                self.connections[key] = used
+
+        for key in sorted(self.connections, key=self.connections.get):
+            self.connections.move_to_end(key)
+
+        self.hits += hits
+        self.misses += misses
+
+    def trim(self):
+        """ Closes the least recently used connections, until the pool is
+        within its maximum size.
+
+        """
+        if self.max_size is None:
+            return
+
+        while len(self.connections) > self.max_size:
+            key, _ = self.connections.popitem(last=False)
+            self.close_connection(key)
+
+    def close_connection(self, key):
+        path = self.control_path(key)
+
+        if not os.path.exists(path):
+            return
+
+        log.debug(u'closing ssh master connection {}'.format(path))
+
+        # the host argument is required but unused if a master is running
+        try:
+            subprocess.call((  # nosec
+                'ssh', '-o', 'ControlPath={}'.format(path), '-O', 'exit',
+                'suitable'
+            ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            log.warning(u'could not close {}: {}'.format(path, e))
+
+    def close(self):
+        """ Closes all connections of the pool. """
+
+        while self.connections:
+            key, _ = self.connections.popitem()
+            self.close_connection(key)
+
+        if self._owns_directory and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
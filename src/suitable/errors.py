@@ -37,3 +37,14 @@ class UnreachableError(SuitableError):
 
     def __str__(self):
         return u"{host} could not be reached".format(host=self.host)
+
+
+class HostTimeoutError(SuitableError):
+    def __init__(self, module, host, timeout):
+        self.module = module
+        self.host = host
+        self.timeout = timeout
+
+    def __str__(self):
+        return u"{host} did not finish within {timeout} seconds".format(
+            host=self.host, timeout=self.timeout)
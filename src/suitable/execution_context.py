@@ -0,0 +1,771 @@
+import __main__
+import atexit
+import ansible.constants
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from concurrent.futures import thread as futures_thread
+from ansible.executor.stats import AggregateStats
+from ansible.executor.task_queue_manager import TaskQueueManager
+from ansible.parsing.dataloader import DataLoader
+from ansible.inventory.manager import InventoryManager
+from ansible.playbook.play import Play
+from ansible.utils.display import Display
+from ansible.vars.fact_cache import FactCache
+from ansible.vars.manager import VariableManager
+from contextlib import contextmanager, ExitStack
+from suitable.common import log
+from suitable.forks import cpu_time
+from suitable.instrumentation import TimingCallbackModule
+
+try:
+    from ansible import context
+except ImportError:
+    set_global_context = None
+else:
+    set_global_context = context._init_global_context
+
+
+# the display instance whose verbosity is changed by ansible_verbosity
+__main__.display = display = Display()
+
+
+@contextmanager
+def ansible_verbosity(verbosity):
+    """ Temporarily changes the ansible verbosity. Relies on a single display
+    instance being referenced by the __main__ module.
+
+    This is setup when suitable.execution_context is first imported, which
+    happens once the public api of suitable (e.g. suitable.Api) is first
+    used, not when suitable itself is imported. Ansible could already be
+    imported beforehand, in which case the output might not be as verbose
+    as expected.
+
+    To be sure, use suitable's api before importing ansible.
+
+    """
+    previous = display.verbosity
+    display.verbosity = verbosity
+    yield
+    display.verbosity = previous
+
+
+@contextmanager
+def environment_variable(key, value):
+    """ Temporarily overrides an environment variable. """
+
+    if key not in os.environ:
+        previous = None
+    else:
+        previous = os.environ[key]
+
+    os.environ[key] = value
+
+    yield
+
+    if previous is None:
+        del os.environ[key]
+    else:
+        os.environ[key] = previous
+
+
+@contextmanager
+def host_key_checking(enable):
+    """ Temporarily disables host_key_checking, which is set globally. """
+
+    def as_string(b):
+        return b and 'True' or 'False'
+
+    with environment_variable('ANSIBLE_HOST_KEY_CHECKING', as_string(enable)):
+        previous = ansible.constants.HOST_KEY_CHECKING
+
+        ansible.constants.HOST_KEY_CHECKING = enable
+        yield
+        ansible.constants.HOST_KEY_CHECKING = previous
+
+
+def reset_global_context():
+    """ Ansible 2.8 introduces a global context which persists during the
+    lifetime of the process - for Suitable this singleton/cache needs to be
+    cleared after each call to make sure that API calls do not carry over
+    state.
+
+    The docs hint at a future inclusion of local contexts, which would of
+    course be preferable.
+
+    """
+    from ansible.utils.context_objects import GlobalCLIArgs
+    GlobalCLIArgs._Singleton__instance = None
+
+
+def forget_executor_threads():
+    """ Ansible forks its workers from the thread running the play. If that
+    thread belongs to a :class:`concurrent.futures.ThreadPoolExecutor`, the
+    worker tries to join the executor's threads (including itself) when it
+    exits, which fails and makes Ansible consider the worker dead.
+
+    None of these threads exist in the forked worker, so we forget them.
+
+    """
+    futures_thread._threads_queues.clear()
+
+
+os.register_at_fork(after_in_child=forget_executor_threads)
+
+
+# the group of the hosts a play is limited to
+SELECTED_GROUP = 'suitable_selected'
+
+
+class GlobalState(object):
+    """ Applies the settings Ansible keeps in process-global state (the
+    global context, the display verbosity and host key checking) for the
+    duration of a run.
+
+    Runs from different threads which require the same settings share them
+    and proceed concurrently. Runs which require other settings wait until
+    the settings are no longer in use. Once a run is waiting, no further
+    runs join the current settings, so all of them get their turn.
+
+    Ansible's plugin loaders are not thread-safe. Before the first time
+    runs overlap, all plugins loaded by the controller are therefore loaded
+    up front, while no run is in progress.
+
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.key = None
+        self.users = 0
+        self.draining = False
+        self.stack = None
+        self.preloaded = False
+
+    def preload_plugins(self):
+        from ansible.plugins import loader
+
+        for plugin_loader in (
+            loader.cache_loader,
+            loader.callback_loader,
+            loader.strategy_loader,
+            loader.vars_loader,
+        ):
+            for _ in plugin_loader.all(class_only=True):
+                pass
+
+        for plugin_loader in (loader.filter_loader, loader.test_loader):
+            for _ in plugin_loader.all():
+                pass
+
+        self.preloaded = True
+
+    def may_join(self, key):
+        return self.preloaded and self.key == key and not self.draining
+
+    def get_key(self, api):
+        options = sorted(vars(api.options).items(), key=lambda i: i[0])
+
+        return (
+            self.get_verbosity(api),
+            bool(api.host_key_checking),
+            repr(options)
+        )
+
+    def get_verbosity(self, api):
+        # ansible uses various levels of verbosity (from -v to -vvvvvv)
+        # offering various amounts of debug information
+        #
+        # we keep it a bit simpler by activating all of it during debug,
+        # and falling back to the default of 0 otherwise
+        return api.options.verbosity == logging.DEBUG and 6 or 0
+
+    def apply(self, api):
+        stack = ExitStack()
+
+        if set_global_context:
+            reset_global_context()
+            set_global_context(api.options)
+            stack.callback(reset_global_context)
+
+        stack.enter_context(ansible_verbosity(self.get_verbosity(api)))
+
+        # host_key_checking is special, since not each connection plugin
+        # handles it the same way, we need to apply both environment
+        # variable and Ansible constant when running a command in the
+        # runner to be successful
+        stack.enter_context(host_key_checking(api.host_key_checking))
+
+        return stack
+
+    @contextmanager
+    def settings(self, api):
+        """ Applies the settings of the given api, waiting for runs with
+        other settings to finish first.
+
+        """
+        key = self.get_key(api)
+
+        with self.condition:
+            while self.users and not self.may_join(key):
+                if self.key != key or not self.preloaded:
+                    self.draining = True
+
+                self.condition.wait()
+
+            if not self.users:
+
+                # only done once runs overlap for the first time
+                if self.draining and not self.preloaded:
+                    self.preload_plugins()
+
+                self.stack = self.apply(api)
+                self.key = key
+                self.draining = False
+
+            self.users += 1
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.users -= 1
+
+                if not self.users:
+                    stack, self.stack = self.stack, None
+                    self.key = None
+
+                    try:
+                        stack.close()
+                    finally:
+                        self.condition.notify_all()
+
+
+# the global state is shared by all api instances in the process
+GLOBAL_STATE = GlobalState()
+
+
+class Deadline(object):
+    """ Stops the play of the given task queue manager once it has been
+    running for the given number of seconds. Used as a context manager
+    around the run.
+
+    Ansible's strategies stop scheduling tasks and waiting for results
+    once the task queue manager is terminated. The workers still running
+    (e.g. waiting on a hung host) are terminated right away.
+
+    """
+
+    def __init__(self, task_queue_manager, timeout):
+        self.task_queue_manager = task_queue_manager
+        self.timeout = timeout
+        self.expired = False
+        self.timer = None
+
+    def __enter__(self):
+        if self.timeout is not None:
+            self.timer = threading.Timer(self.timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.cancel()
+
+            # the timer may have fired right before the play ended, wait
+            # for it, so expired is accurate once the context is left
+            self.timer.join()
+
+    def expire(self):
+        log.warning(u'play stopped after {} seconds'.format(self.timeout))
+
+        self.expired = True
+        self.task_queue_manager.terminate()
+
+        for worker in self.task_queue_manager.get_workers():
+            if worker and worker.is_alive():
+                worker.terminate()
+
+
+class SourcelessInventoryManager(InventoryManager):
+    """ A custom inventory manager that turns the source parsing into a noop.
+
+    Without this, Ansible will warn that there are no inventory sources that
+    could be parsed. Naturally we do not have such sources, rendering this
+    warning moot.
+
+    """
+
+    def parse_sources(self, *args, **kwargs):
+        pass
+
+
+class ExecutionContext(object):
+    """ Holds the Ansible loader, inventory manager and variable manager
+    used to run plays against the inventory of an api instance.
+
+    The Ansible objects are created on first use. Before each run, the
+    Ansible inventory is brought in line with the inventory of the api, by
+    adding, updating and removing only the hosts which changed since the
+    last run. This way, a context can be reused for many module calls,
+    without having to build the whole Ansible inventory each time.
+
+    Runs limited to some hosts only add or update those hosts.
+
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+        self.loader = None
+        self.inventory_manager = None
+        self.variable_manager = None
+
+        # the host variables, groups and extra vars as of the last
+        # synchronisation (groups as tuple of variables and hosts)
+        self.hosts = {}
+        self.groups = {}
+        self.extra_vars = None
+
+        # the keys of pooled connections by host
+        self.connection_keys = {}
+
+        # kept between runs if the api is persistent
+        self.task_queue_manager = None
+
+        self.lock = threading.RLock()
+
+    @property
+    def is_initialized(self):
+        return self.loader is not None
+
+    def initialize(self):
+        self.loader = DataLoader()
+        self.inventory_manager = SourcelessInventoryManager(loader=self.loader)
+        self.variable_manager = VariableManager(
+            loader=self.loader, inventory=self.inventory_manager)
+
+    def add_host(self, host, host_variables):
+        inventory = self.inventory_manager._inventory
+        inventory.add_host(host, group='all')
+
+        variables = host_variables
+        pool = self.api.connection_pool
+
+        if pool is not None:
+            connection_key = pool.key(self.api, host, host_variables)
+
+            if connection_key is not None:
+                self.connection_keys[host] = connection_key
+
+                # variables set by the user take precedence
+                variables = dict(pool.host_variables(connection_key))
+                variables.update(host_variables)
+
+        for key, value in variables.items():
+            inventory.set_variable(host, key, value)
+
+        self.hosts[host] = dict(host_variables)
+
+    def remove_host(self, host):
+        inventory = self.inventory_manager._inventory
+        inventory_host = inventory.hosts.get(host)
+
+        if inventory_host is not None:
+            inventory.remove_host(inventory_host)
+
+            if inventory.localhost is inventory_host:
+                inventory.localhost = None
+
+        del self.hosts[host]
+        self.connection_keys.pop(host, None)
+
+        # Ansible removes the host from its groups
+        for _, hosts in self.groups.values():
+            hosts.discard(host)
+
+    def sync_group(self, group):
+        inventory = self.inventory_manager._inventory
+
+        if group.name not in self.groups:
+            inventory.add_group(group.name)
+            self.groups[group.name] = (None, set())
+
+        variables, hosts = self.groups[group.name]
+        ansible_group = inventory.groups[group.name]
+
+        if variables != group.variables:
+            ansible_group.vars = {}
+
+            for key, value in group.variables.items():
+                ansible_group.set_variable(key, value)
+
+            self.groups[group.name] = (dict(group.variables), hosts)
+
+        # only hosts in the Ansible inventory can be added
+        members = {h for h in group.hosts if h in self.hosts}
+
+        for host in members - hosts:
+            inventory.add_child(group.name, host)
+
+        for host in hosts - members:
+            ansible_group.remove_host(inventory.hosts[host])
+
+        hosts.clear()
+        hosts.update(members)
+
+    def remove_group(self, name):
+        inventory = self.inventory_manager._inventory
+        group = inventory.groups[name]
+
+        # Ansible does not take the group away from its hosts by itself
+        for host in group.get_hosts():
+            group.remove_host(host)
+
+        inventory.remove_group(name)
+        del self.groups[name]
+
+    def set_extra_vars(self, extra_vars):
+        group = self.inventory_manager._inventory.groups['all']
+        group.vars = {}
+
+        for key, value in extra_vars.items():
+            group.set_variable(key, value)
+
+        self.extra_vars = dict(extra_vars)
+
+    def sync(self, hosts=None):
+        """ Brings the Ansible inventory in line with the api's inventory.
+
+        If hosts are given, only those are added or updated, the others are
+        left as they are until they are needed.
+
+        """
+        inventory = self.api.inventory
+
+        for host in [h for h in self.hosts if h not in inventory]:
+            self.remove_host(host)
+
+        if hosts is None:
+            hosts = list(inventory)
+
+        for host in hosts:
+            host_variables = inventory.get(host)
+
+            # removed by a concurrent call
+            if host_variables is None:
+                continue
+
+            previous = self.hosts.get(host)
+
+            if previous == host_variables:
+                continue
+
+            # re-add changed hosts, so removed variables do not linger
+            if previous is not None:
+                self.remove_host(host)
+
+            self.add_host(host, host_variables)
+
+        groups = self.api.inventory.groups
+
+        for name in [g for g in self.groups if g not in groups]:
+            self.remove_group(name)
+
+        for group in groups.values():
+            self.sync_group(group)
+
+        if self.extra_vars != self.api.options.extra_vars:
+            self.set_extra_vars(self.api.options.extra_vars)
+
+        self.inventory_manager.clear_caches()
+
+    def reset(self):
+        """ Clears the state Ansible keeps between plays, so facts and
+        registered variables of one call do not leak into the next.
+
+        """
+        self.variable_manager._nonpersistent_fact_cache.clear()
+        self.variable_manager._vars_cache.clear()
+        self.variable_manager._fact_cache = FactCache()
+
+    def prepare(self, hosts=None):
+        if self.is_initialized:
+            self.reset()
+        else:
+            self.initialize()
+
+        self.sync(hosts)
+
+        if self.api.facts_cache is not None:
+            self.inject_facts()
+
+    def get_task_queue_manager(self, callback, forks):
+        """ Returns the task queue manager reporting to the given callback,
+        running the given number of forks.
+
+        For persistent apis, the task queue manager is created once and then
+        reused, which spares us setting up its result queue and loading the
+        callback plugins for each run.
+
+        """
+        if self.task_queue_manager is None:
+            kwargs = dict(
+                inventory=self.inventory_manager,
+                variable_manager=self.variable_manager,
+                loader=self.loader,
+                options=self.api.options,
+                passwords=getattr(self.api.options, 'passwords', {}),
+                stdout_callback=callback,
+                forks=forks
+            )
+
+            if set_global_context:
+                del kwargs['options']
+
+            task_queue_manager = TaskQueueManager(**kwargs)
+
+            if self.api.persistent:
+                self.task_queue_manager = task_queue_manager
+
+            return task_queue_manager
+
+        task_queue_manager = self.task_queue_manager
+
+        # the workers are set up on each run, according to the forks
+        task_queue_manager._forks = forks
+
+        # the stdout callback is only referenced when sending callbacks,
+        # so it is safe to swap it between runs
+        task_queue_manager._stdout_callback = callback
+
+        # Ansible remembers failed and unreachable hosts between plays,
+        # Suitable takes care of that by itself
+        task_queue_manager.clear_failed_hosts()
+        task_queue_manager._unreachable_hosts = dict()
+        task_queue_manager._stats = AggregateStats()
+
+        # a terminated task queue manager runs no further tasks, it is not
+        # kept after timeouts, but this makes sure it does not linger
+        task_queue_manager._terminated = False
+
+        return task_queue_manager
+
+    def close(self):
+        """ Shuts down the persistent task queue manager, if any. """
+
+        with self.lock:
+            self.close_task_queue_manager()
+
+    def close_task_queue_manager(self):
+        if self.task_queue_manager is not None:
+            task_queue_manager, self.task_queue_manager = \
+                self.task_queue_manager, None
+
+            task_queue_manager.cleanup()
+
+    def run(self, tasks, callback, hosts=None, block=True, strategy=None,
+            timeout=None):
+        """ Runs the given tasks as a play against the inventory (or the
+        given hosts of the inventory), reporting to the given callback.
+        The strategy of the api is used, unless another one is given.
+
+        If a timeout is given, the play is stopped once it has run for that
+        many seconds. Returns True if that happened.
+
+        Runs on the same context are serialised, runs on different contexts
+        may happen concurrently in separate threads. If ``block`` is false
+        and the context is in use, the tasks are run in a new context
+        instead of waiting.
+
+        """
+        if not self.lock.acquire(blocking=block):
+            context = ExecutionContext(self.api)
+
+            try:
+                return context.run(
+                    tasks, callback, hosts, strategy=strategy, timeout=timeout)
+            finally:
+                context.close()
+
+        try:
+            with GLOBAL_STATE.settings(self.api):
+                return self.run_play(
+                    tasks, callback, hosts, strategy, timeout)
+        finally:
+            self.lock.release()
+
+    def select_hosts(self, hosts):
+        """ Puts the given hosts into a group of their own and returns the
+        name of the group, to be used as the play's host pattern.
+
+        Host names cannot be used as patterns directly, since they may
+        contain characters with a special meaning (e.g. 'host:port').
+
+        """
+        inventory = self.inventory_manager._inventory
+        inventory.add_group(SELECTED_GROUP)
+
+        for host in hosts:
+            if host in self.hosts:
+                inventory.add_child(SELECTED_GROUP, host)
+
+        self.inventory_manager.clear_caches()
+
+        return SELECTED_GROUP
+
+    def deselect_hosts(self):
+        group = self.inventory_manager._inventory.groups.get(SELECTED_GROUP)
+
+        if group is not None:
+            for host in group.get_hosts():
+                group.remove_host(host)
+
+            self.inventory_manager.clear_caches()
+
+    def get_connection_keys(self, hosts=None):
+        if hosts is None:
+            return list(self.connection_keys.values())
+
+        return [
+            self.connection_keys[host] for host in hosts
+            if host in self.connection_keys
+        ]
+
+    def inject_facts(self):
+        """ Provides the fresh facts of the api's facts cache to the play.
+
+        """
+        facts = self.api.facts_cache.fresh(self.hosts)
+
+        # Ansible updates the facts it is given in place
+        for host, host_facts in facts.items():
+            self.variable_manager.set_host_facts(host, dict(host_facts))
+
+    def run_play(self, tasks, callback, hosts=None, strategy=None,
+                 timeout=None):
+        play_source = {
+            'name': "Suitable Play",
+            'hosts': 'all',
+            'gather_facts': 'no',
+            'tasks': tasks
+        }
+
+        task_queue_manager = None
+
+        pool = self.api.connection_pool
+        instrumentation = self.api.instrumentation
+
+        if instrumentation:
+            callback = TimingCallbackModule(callback, instrumentation)
+
+        # quarantined hosts are skipped
+        if self.api.health is not None:
+            quarantined = self.api.health.quarantined()
+
+            if hosts is None and quarantined.intersection(self.api.inventory):
+                hosts = list(self.api.inventory)
+
+            if hosts is not None:
+                hosts = [h for h in hosts if h not in quarantined]
+
+        try:
+            with instrumentation.span('suitable.inventory'):
+                self.prepare(hosts)
+
+                if hosts is not None:
+                    play_source['hosts'] = self.select_hosts(hosts)
+
+                if pool is not None:
+                    pool.checkout(self.get_connection_keys(hosts))
+
+            with instrumentation.span('suitable.play_load'):
+                play = Play.load(
+                    play_source,
+                    variable_manager=self.variable_manager,
+                    loader=self.loader,
+                )
+
+            strategy = strategy or self.api.strategy
+
+            if strategy:
+                play.strategy = strategy
+
+            selected = len(self.hosts if hosts is None else hosts)
+            forks = self.api.fork_policy.choose(selected)
+
+            with instrumentation.span('suitable.task_queue_manager'):
+                task_queue_manager = self.get_task_queue_manager(
+                    callback, forks)
+
+            start, cpu_start = time.monotonic(), cpu_time()
+
+            deadline = Deadline(task_queue_manager, timeout)
+
+            try:
+                with instrumentation.span(
+                        'suitable.run', hosts=selected, forks=forks), \
+                        deadline:
+                    if instrumentation:
+                        callback.start_clock()
+
+                    task_queue_manager.run(play)
+            except SystemExit:
+
+                # Mitogen forks our process and exits it in one
+                # instance before returning
+                #
+                # This is fine, but it does lead to a very messy exit
+                # by py.test which will essentially return with a test
+                # that is first successful and then failed as each
+                # forked process dies.
+                #
+                # To avoid this we commit suicide if we are run inside
+                # a pytest session. Normally this would just result
+                # in a exit code of zero, which is good.
+                if 'pytest' in sys.modules:
+                    try:
+                        atexit._run_exitfuncs()
+                    except Exception:
+                        pass  # nosec
+                    os.kill(os.getpid(), signal.SIGKILL)
+
+                raise
+
+            # the task queue manager stays terminated
+            if deadline.expired:
+                if task_queue_manager is self.task_queue_manager:
+                    self.task_queue_manager = None
+
+                return True
+
+            self.api.fork_policy.observe(
+                selected, forks,
+                time.monotonic() - start, cpu_time() - cpu_start)
+
+            return False
+        except BaseException:
+            # do not reuse a task queue manager in an unknown state
+            if task_queue_manager is not None:
+                self.task_queue_manager = None
+            raise
+        finally:
+            if task_queue_manager is not None:
+                if task_queue_manager is not self.task_queue_manager:
+                    task_queue_manager.cleanup()
+
+            if pool is not None:
+                pool.trim()
+
+            if hosts is not None and self.is_initialized:
+                self.deselect_hosts()
+
+            # results registered during the play (see suitable.batch) are
+            # not needed anymore, there is no point in keeping them around
+            if self.variable_manager is not None:
+                self.variable_manager._nonpersistent_fact_cache.clear()
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from suitable.common import log
+
+
+CACHE_VERSION = 1
+
+
+class FactsCache(object):
+    """ Keeps the facts gathered from hosts (through the ``setup`` module)
+    around, until they are older than ``ttl`` seconds.
+
+    Apis with a facts cache serve :meth:`suitable.api.Api.facts` from the
+    cache and provide the cached facts as host variables to all module
+    calls (e.g. ``ansible_facts`` or ``ansible_distribution``)::
+
+        api = Api(servers, facts_cache=FactsCache(ttl=600))
+
+        api.facts('example.org')['distribution']
+        api.command('echo {{ ansible_distribution }}')
+
+    If a cache file is given, the facts are additionally persisted to disk,
+    so they survive the process. A cache may be shared by multiple apis.
+
+    """
+
+    def __init__(self, ttl=3600, cache_file=None):
+        self.ttl = ttl
+        self.cache_file = cache_file
+
+        # host -> (time gathered, facts)
+        self.facts = None
+
+        self.lock = threading.RLock()
+
+    def ensure_loaded(self):
+        if self.facts is None:
+            self.facts = {}
+
+            if self.cache_file:
+                self.load()
+
+    def is_fresh(self, gathered, now=None):
+        return (now or time.time()) - gathered < self.ttl
+
+    def get(self, host):
+        """ Returns the facts of the given host, or None if there are no
+        fresh facts.
+
+        """
+        with self.lock:
+            self.ensure_loaded()
+
+            entry = self.facts.get(host)
+
+            if entry is None or not self.is_fresh(entry[0]):
+                return None
+
+            return entry[1]
+
+    def fresh(self, hosts):
+        """ Returns a dict with the fresh facts of the given hosts. Hosts
+        without fresh facts are left out.
+
+        """
+        with self.lock:
+            self.ensure_loaded()
+
+            now = time.time()
+            facts = {}
+
+            for host in hosts:
+                entry = self.facts.get(host)
+
+                if entry is not None and self.is_fresh(entry[0], now):
+                    facts[host] = entry[1]
+
+            return facts
+
+    def stale(self, hosts):
+        """ Returns the given hosts without fresh facts. """
+
+        fresh = self.fresh(hosts)
+        return [host for host in hosts if host not in fresh]
+
+    def update(self, facts):
+        """ Stores the given facts (a dict of hosts and their facts). """
+
+        with self.lock:
+            self.ensure_loaded()
+
+            now = time.time()
+
+            for host, host_facts in facts.items():
+                self.facts[host] = (now, host_facts)
+
+            if self.cache_file:
+                self.save()
+
+    def clear(self, hosts=None):
+        """ Removes the facts of the given hosts, or of all hosts. """
+
+        with self.lock:
+            self.ensure_loaded()
+
+            if hosts is None:
+                self.facts.clear()
+            else:
+                for host in hosts:
+                    self.facts.pop(host, None)
+
+            if self.cache_file:
+                self.save()
+
+    def load(self):
+        """ Loads the facts from the cache file, skipping expired ones.
+        Returns True if successful.
+
+        """
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return False
+
+        now = time.time()
+
+        try:
+            for host, (gathered, facts) in data['hosts'].items():
+                if self.is_fresh(gathered, now):
+                    self.facts[host] = (gathered, facts)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            self.facts.clear()
+            return False
+
+        return True
+
+    def save(self):
+        """ Writes the facts to the cache file, atomically.
+
+        Failures are logged and otherwise ignored, the facts are still
+        cached in memory.
+
+        """
+        data = {
+            'version': CACHE_VERSION,
+            'hosts': self.facts,
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(temp, self.cache_file)
+            except BaseException:
+                os.unlink(temp)
+                raise
+
+        except (OSError, TypeError, ValueError) as e:
+            log.debug(u'could not write facts cache: {}'.format(e))
@@ -0,0 +1,173 @@
+import os
+import threading
+
+from ansible import constants as C
+from collections import deque
+
+
+# the workers are forked from the process running the play, so most of
+# their memory is shared - this is a conservative estimate of what each
+# worker adds on top
+WORKER_MEMORY = 64 * 1024 * 1024
+
+# workers spend most of their time waiting on remote hosts, so without any
+# observations, we assume that a core can keep this many of them busy
+WORKERS_PER_CPU = 8
+
+# the weight of the latest observation in the moving averages
+SMOOTHING = 0.5
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def available_memory():
+    """ Returns the available memory in bytes, or None if unknown. """
+
+    # on Linux, the free memory does not include the page cache, which
+    # would be given up for the workers, so it is too low to be useful
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):  # pragma: no cover
+        return None
+
+
+def configured_forks():
+    """ Returns the number of forks configured for Ansible (through
+    ``ANSIBLE_FORKS`` or ansible.cfg), or None if it is not configured.
+
+    """
+    forks, origin = C.config.get_config_value_and_origin('DEFAULT_FORKS')
+
+    if origin == 'default':
+        return None
+
+    return forks
+
+
+def cpu_time():
+    """ Returns the CPU time used by this process and its terminated
+    children (i.e. the Ansible workers) so far.
+
+    """
+    times = os.times()
+
+    return sum((
+        times.user, times.system, times.children_user, times.children_system
+    ))
+
+
+class ForkPolicy(object):
+    """ Picks the number of forks (parallel Ansible workers) of each call.
+
+    With few observations, the number of forks is limited by the available
+    CPUs and memory (though low memory does not push it below Ansible's
+    default number of forks). Once calls have been observed, the policy
+    aims to keep the CPUs busy:
+
+    Each worker spends some time on a host (the latency), of which only a
+    fraction is spent on the CPU of this machine (connecting, transferring
+    the module and processing the result). The rest is spent waiting on
+    the host. If a host takes a second and only 50ms of that are CPU time,
+    twenty workers keep a CPU busy. Once the CPUs are saturated, adding
+    workers increases the latency as well, so the number of forks settles.
+
+    The number of forks is always within ``minimum`` and ``maximum`` and
+    never larger than the number of hosts. Pass the same value for both,
+    to use a fixed number of forks. Without ``maximum``, the number of
+    forks configured for Ansible (if any) is the maximum.
+
+    The chosen number of forks and the observations that lead to it are
+    available as attributes:
+
+    - ``forks``: the number of forks of the latest call
+    - ``latency``: the average seconds a worker spent per host
+    - ``cpu_per_host``: the average CPU seconds spent per host
+    - ``history``: the latest calls as ``(hosts, forks, seconds)`` tuples
+
+    Observations are averaged across calls. Calls running concurrently
+    share the CPU, which makes the CPU times less accurate.
+
+    """
+
+    def __init__(self, minimum=1, maximum=None, history=10):
+        self.minimum = minimum
+        self.maximum = maximum if maximum is not None else configured_forks()
+        self.cpus = available_cpus()
+
+        self.forks = None
+        self.latency = None
+        self.cpu_per_host = None
+        self.history = deque(maxlen=history)
+
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """ The largest number of forks the resources allow. """
+
+        if self.maximum is not None:
+            return self.maximum
+
+        limit = self.cpus * WORKERS_PER_CPU
+        memory = available_memory()
+
+        # the memory estimate is conservative, it does not get to push the
+        # number of forks below the default of Ansible
+        if memory is not None:
+            limit = min(limit, max(memory // WORKER_MEMORY, C.DEFAULT_FORKS))
+
+        return max(self.minimum, limit)
+
+    def choose(self, hosts):
+        """ Returns the number of forks to use for a call with the given
+        number of hosts.
+
+        """
+        with self.lock:
+            limit = self.limit
+
+            if self.latency and self.cpu_per_host:
+                forks = self.cpus * self.latency / self.cpu_per_host
+                forks = min(int(round(forks)), limit)
+            else:
+                forks = limit
+
+            self.forks = max(self.minimum, min(forks, hosts, limit))
+
+            return self.forks
+
+    def observe(self, hosts, forks, seconds, cpu_seconds):
+        """ Records the duration and CPU time of a call. """
+
+        if not hosts or not seconds:
+            return
+
+        # the workers handled the hosts in parallel, as long as there
+        # were more hosts than workers
+        latency = seconds * min(forks, hosts) / hosts
+        cpu_per_host = cpu_seconds / hosts
+
+        with self.lock:
+            self.latency = average(self.latency, latency)
+            self.cpu_per_host = average(self.cpu_per_host, cpu_per_host)
+            self.history.append((hosts, forks, seconds))
+
+
+def average(previous, value):
+    if previous is None:
+        return value
+
+    return previous * (1 - SMOOTHING) + value * SMOOTHING
@@ -0,0 +1,157 @@
+import time
+
+from ansible.plugins.callback import CallbackBase
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from suitable.common import log
+
+
+# a timed section of a module call, start is a unix timestamp and the
+# duration is measured in seconds
+Span = namedtuple('Span', ('name', 'start', 'duration', 'attributes'))
+
+# returned instead of a span if there are no hooks
+NULL_SPAN = nullcontext()
+
+
+class Instrumentation(object):
+    """ Measures the time spent in the sections of a module call and hands
+    the timings to the registered hooks, as :class:`Span`::
+
+        def hook(span):
+            print(span.name, span.duration, span.attributes)
+
+        api = Api('example.org', instrumentation=[hook])
+        api.command('uptime')
+
+    The following spans are emitted for each call:
+
+    - ``suitable.call``: the whole call, including the evaluation
+    - ``suitable.inventory``: bringing the Ansible inventory up to date
+    - ``suitable.play_load``: loading the play
+    - ``suitable.task_queue_manager``: setting up the task queue manager
+    - ``suitable.run``: running the play
+    - ``suitable.host``: from the start of the play until the result of a
+      host came in, once per host and task
+    - ``suitable.evaluate``: evaluating the results
+
+    Hooks are called from the thread making the call. The spans measured
+    in shard processes are passed on once the shard is done.
+    Errors raised by hooks are logged and otherwise ignored. Without hooks,
+    the sections are not measured at all.
+
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+
+    def __bool__(self):
+        return bool(self.hooks)
+
+    def add(self, hook):
+        self.hooks.append(hook)
+
+    def remove(self, hook):
+        self.hooks.remove(hook)
+
+    def emit(self, name, start, duration, **attributes):
+        span = Span(name, start, duration, attributes)
+
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception:
+                log.exception(u'instrumentation hook {} failed'.format(hook))
+
+    def span(self, name, **attributes):
+        """ Returns a context manager measuring the time spent inside. """
+
+        if not self.hooks:
+            return NULL_SPAN
+
+        return self.measure(name, attributes)
+
+    @contextmanager
+    def measure(self, name, attributes):
+        start = time.time()
+        counter = time.perf_counter()
+
+        try:
+            yield
+        except BaseException as e:
+            attributes['error'] = type(e).__name__
+            raise
+        finally:
+            self.emit(name, start, time.perf_counter() - counter, **attributes)
+
+
+class TimingCallbackModule(CallbackBase):
+    """ Wraps a callback module, emitting a ``suitable.host`` span for each
+    result, before passing it on.
+
+    """
+
+    def __init__(self, callback, instrumentation):
+        self.callback = callback
+        self.instrumentation = instrumentation
+        self.start_clock()
+
+    def start_clock(self):
+        """ Starts measuring the time, which should happen right before the
+        play is run.
+
+        """
+        self.start = time.time()
+        self.counter = time.perf_counter()
+
+    def emit(self, result, status):
+        self.instrumentation.emit(
+            'suitable.host',
+            self.start,
+            time.perf_counter() - self.counter,
+            host=result._host.name,
+            task=result._task.get_name(),
+            status=status
+        )
+
+    def v2_runner_on_ok(self, result):
+        self.emit(result, 'ok')
+        self.callback.v2_runner_on_ok(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.emit(result, 'failed')
+        self.callback.v2_runner_on_failed(result, ignore_errors)
+
+    def v2_runner_on_unreachable(self, result):
+        self.emit(result, 'unreachable')
+        self.callback.v2_runner_on_unreachable(result)
+
+
+class OpenTelemetryHook(object):
+    """ Passes the spans to an OpenTelemetry tracer::
+
+        from opentelemetry import trace
+
+        hook = OpenTelemetryHook(trace.get_tracer('suitable'))
+        api = Api('example.org', instrumentation=[hook])
+
+    OpenTelemetry is not required by Suitable, any object with the same
+    ``start_span`` method works.
+
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def __call__(self, span):
+        start = int(span.start * 1e9)
+        end = start + int(span.duration * 1e9)
+
+        self.tracer.start_span(
+            span.name,
+            start_time=start,
+            attributes={
+                k: v if isinstance(v, (str, bool, int, float)) else str(v)
+                for k, v in span.attributes.items()
+            }
+        ).end(end_time=end)
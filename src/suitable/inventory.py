@@ -1,12 +1,128 @@
+import fnmatch
+
+from bisect import bisect_left
+
+
+# groups Ansible manages by itself
+RESERVED_GROUPS = ('all', 'ungrouped')
+
+# characters marking a pattern as glob
+WILDCARDS = ('*', '?', '[')
+
+
+class Group(object):
+    """ A group of hosts, whose variables apply to all of its hosts. The
+    variables are stored once for the group, not copied into each host.
+
+    """
+
+    __slots__ = ('name', 'hosts', 'variables')
+
+    def __init__(self, name, variables=None):
+        self.name = name
+        self.hosts = set()
+        self.variables = dict(variables or {})
+
+
+class InventoryIndex(object):
+    """ Indexes the hosts of an inventory by name and by variable, so hosts
+    can be selected without looking at each of them.
+
+    """
+
+    def __init__(self, inventory):
+        self.names = sorted(inventory)
+        self.variables = {}
+
+        for host, host_variables in inventory.items():
+            for key, value in host_variables.items():
+                if isinstance(value, (str, int, float, bool)):
+                    self.variables.setdefault((key, str(value)), set()).add(
+                        host)
+
+    def glob(self, pattern):
+        """ Returns the hosts matching the given glob pattern. Patterns with
+        a fixed prefix (e.g. 'web*') only look at the names with the prefix.
+
+        """
+        prefix = pattern[:min(
+            (pattern.index(c) for c in WILDCARDS if c in pattern),
+            default=len(pattern)
+        )]
+
+        hosts = []
+
+        for i in range(bisect_left(self.names, prefix), len(self.names)):
+            name = self.names[i]
+
+            if not name.startswith(prefix):
+                break
+
+            if fnmatch.fnmatchcase(name, pattern):
+                hosts.append(name)
+
+        return hosts
+
+    def variable(self, key, value):
+        return self.variables.get((key, value), set())
+
+
 class Inventory(dict):
 
     def __init__(self, ansible_connection=None, hosts=None):
         super(Inventory, self).__init__()
         self.ansible_connection = ansible_connection
+        self.groups = {}
+
+        # built on demand and dropped when hosts are added or removed
+        self._index = None
+
         if hosts:
             self.add_hosts(hosts)
 
-    def add_host(self, server, host_variables):
+    def __setitem__(self, key, value):
+        self._index = None
+        super(Inventory, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._index = None
+        super(Inventory, self).__delitem__(key)
+
+    def pop(self, *args):
+        self._index = None
+        return super(Inventory, self).pop(*args)
+
+    def popitem(self):
+        self._index = None
+        return super(Inventory, self).popitem()
+
+    def setdefault(self, *args):
+        self._index = None
+        return super(Inventory, self).setdefault(*args)
+
+    def update(self, *args, **kwargs):
+        self._index = None
+        super(Inventory, self).update(*args, **kwargs)
+
+    def clear(self):
+        self._index = None
+        super(Inventory, self).clear()
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = InventoryIndex(self)
+
+        return self._index
+
+    def reindex(self):
+        """ Rebuilds the index, which is necessary if host variables are
+        changed in place and selected by value afterwards.
+
+        """
+        self._index = None
+
+    def add_host(self, server, host_variables, groups=()):
         self[server] = {}
 
         # [ipv6]:port
@@ -31,6 +147,9 @@ class Inventory(dict):
             if host in ('localhost', '127.0.0.1', '::1'):
                 self[server]['ansible_connection'] = 'local'
 
+        for group in groups:
+            self.add_group(group, hosts=(server, ))
+
     def add_hosts(self, servers):
         if isinstance(servers, str):
             for server in servers.split(u' '):
@@ -41,3 +160,96 @@ class Inventory(dict):
         else:
             for server in servers:
                 self.add_host(server, {})
+
+    def add_group(self, name, hosts=(), variables=None):
+        """ Adds the given hosts to the group with the given name, which is
+        created if it does not exist yet. Given variables are added to the
+        group variables::
+
+            inventory.add_group('web', ['web1', 'web2'], {'http_port': 80})
+
+        The hosts have to be in the inventory. Groups are passed on to
+        Ansible, so templates may use ``group_names`` and group variables.
+        Host variables take precedence over group variables.
+
+        """
+        assert name not in RESERVED_GROUPS, """
+            '{}' is managed by Ansible
+        """.format(name)
+
+        group = self.groups.get(name)
+
+        if group is None:
+            group = self.groups[name] = Group(name)
+
+        for host in hosts:
+            if host not in self:
+                raise KeyError("{} is not in the inventory".format(host))
+
+            group.hosts.add(host)
+
+        if variables:
+            group.variables.update(variables)
+
+        return group
+
+    def remove_group(self, name):
+        del self.groups[name]
+
+    def group_names(self, host):
+        """ Returns the names of the groups of the given host. """
+
+        return sorted(g.name for g in self.groups.values() if host in g.hosts)
+
+    def select(self, pattern):
+        """ Returns the hosts matching the given pattern, which is one of:
+
+        - the name of a host (``web1.example.org``)
+        - the name of a group (``web``)
+        - a glob pattern matching host names (``web*``)
+        - a variable and its value (``role=db``)
+
+        Names and values are looked up in an index, so selecting hosts does
+        not scale with the size of the inventory (glob patterns without
+        prefix excepted). Raises a KeyError if the pattern is neither a
+        host, a group or a pattern.
+
+        """
+        if pattern in self:
+            return [pattern]
+
+        group = self.groups.get(pattern)
+
+        if group is not None:
+            return sorted(h for h in group.hosts if h in self)
+
+        if '=' in pattern:
+            return sorted(self.select_by_variable(*pattern.split('=', 1)))
+
+        if any(c in pattern for c in WILDCARDS):
+            return self.index.glob(pattern)
+
+        raise KeyError("{} is not in the inventory".format(pattern))
+
+    def select_by_variable(self, key, value):
+        """ Returns the hosts whose variable with the given key has the given
+        value (as string), be it a host or a group variable.
+
+        """
+        # the index may be outdated if variables were changed in place
+        hosts = {
+            h for h in self.index.variable(key, value)
+            if h in self and str(self[h].get(key)) == value
+        }
+
+        for group in self.groups.values():
+            if str(group.variables.get(key)) != value:
+                continue
+
+            # host variables take precedence
+            hosts.update(
+                h for h in group.hosts
+                if h in self and str(self[h].get(key, value)) == value
+            )
+
+        return hosts
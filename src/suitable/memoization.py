@@ -0,0 +1,191 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+
+# modules which only read from the hosts, memoized by default
+READ_ONLY_MODULES = (
+    'find',
+    'getent',
+    'package_facts',
+    'ping',
+    'service_facts',
+    'slurp',
+    'stat',
+)
+
+
+def normalize(module_args):
+    """ Returns the module args as a string, which is the same for equal
+    args, regardless of the order of keys.
+
+    """
+    if isinstance(module_args, str):
+        return module_args
+
+    return json.dumps(module_args, sort_keys=True, default=str)
+
+
+class Memoization(object):
+    """ Keeps the results of read-only module calls around for ``ttl``
+    seconds, so repeated calls with the same arguments are served without
+    contacting the hosts again::
+
+        api = Api(servers, memoization=Memoization(ttl=30))
+
+        api.stat(path='/etc/hosts')  # runs on all servers
+        api.stat(path='/etc/hosts')  # served from memory
+
+    Results are memoized per host and keyed by module, arguments, become
+    settings, check mode and environment, as well as the variables the
+    arguments may be templated with (host, group and extra variables) and
+    the connection settings of the host. If some of the hosts of a call
+    have no memoized result, the module only runs on those. Unreachable
+    hosts and failed results are not memoized. Once more than ``max_size``
+    results are memoized, the least recently used ones are evicted.
+
+    Only calls of the given ``modules`` are memoized. Other modules
+    (e.g. ``command`` with a read-only command) may be added, but be aware
+    that calls of other modules do not invalidate memoized results, use
+    :meth:`clear` for that. Batched and streamed calls are not memoized.
+
+    Memoized results are evaluated like fresh ones, so errors and valid
+    return codes apply as usual.
+
+    """
+
+    def __init__(self, ttl=60, max_size=10000, modules=READ_ONLY_MODULES):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.modules = set(modules)
+
+        # (key, host) -> (time stored, answer), least recently used first
+        self.results = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.results)
+
+    def applies(self, module_name):
+        return module_name in self.modules
+
+    def key(self, api, module_name, module_args):
+        """ Returns the key of a call, the hosts are added separately. """
+
+        options = api.options
+
+        return (
+            module_name,
+            normalize(module_args),
+            bool(options.become),
+            options.become_user,
+            options.become_method,
+            bool(options.check),
+            normalize(api.environment),
+        )
+
+    def host_keys(self, api, hosts):
+        """ Returns a dict with a digest of the variables and connection
+        settings of each of the given hosts, which is added to the key of
+        the host's results.
+
+        """
+        inventory = api.inventory
+        options = api.options
+
+        groups = [
+            (g.name, g.variables, g.hosts) for g in inventory.groups.values()
+        ]
+
+        shared = {
+            'extra_vars': options.extra_vars,
+            'remote_user': options.remote_user,
+            'connection': options.connection,
+        }
+
+        keys = {}
+
+        for host in hosts:
+            variables = dict(shared)
+            variables['host'] = inventory.get(host)
+            variables['groups'] = [
+                (name, group_variables)
+                for name, group_variables, group_hosts in groups
+                if host in group_hosts
+            ]
+
+            keys[host] = hashlib.sha1(
+                normalize(variables).encode('utf-8')).hexdigest()
+
+        return keys
+
+    def get(self, key, hosts, host_keys=None):
+        """ Returns a dict with copies of the memoized answers of the given
+        hosts. Hosts without memoized answer are left out.
+
+        """
+        host_keys = host_keys or {}
+        now = time.time()
+        answers = {}
+
+        with self.lock:
+            for host in hosts:
+                entry_key = (key, host, host_keys.get(host))
+                entry = self.results.get(entry_key)
+
+                if entry is None:
+                    self.misses += 1
+                    continue
+
+                if now - entry[0] >= self.ttl:
+                    del self.results[entry_key]
+                    self.misses += 1
+                    continue
+
+                self.results.move_to_end(entry_key)
+                answers[host] = entry[1]
+                self.hits += 1
+
+        return copy.deepcopy(answers)
+
+    def put(self, key, answers, host_keys=None):
+        """ Memoizes the given answers (a dict of hosts and answers as
+        collected by the callback). Failed answers are skipped.
+
+        """
+        host_keys = host_keys or {}
+        answers = copy.deepcopy({
+            host: answer for host, answer in answers.items()
+            if answer['success']
+        })
+
+        now = time.time()
+
+        with self.lock:
+            for host, answer in answers.items():
+                entry_key = (key, host, host_keys.get(host))
+                self.results[entry_key] = (now, answer)
+                self.results.move_to_end(entry_key)
+
+            while self.max_size is not None \
+                    and len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def clear(self, module_name=None):
+        """ Forgets all memoized results, or those of the given module. """
+
+        with self.lock:
+            if module_name is None:
+                self.results.clear()
+                return
+
+            for key in [k for k in self.results if k[0][0] == module_name]:
+                del self.results[key]
@@ -0,0 +1,192 @@
+import json
+import os
+import tempfile
+import threading
+
+from suitable.common import log
+
+
+CACHE_VERSION = 1
+
+BLACKLISTED_EXTENSIONS = ('.swp', '.bak', '~', '.rpm', '.pyc')
+BLACKLISTED_PREFIXES = ('_', )
+
+
+def default_cache_file():
+    """ Returns the default location of the persisted module index, which
+    follows the XDG base directory specification.
+
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(cache_home, 'suitable', 'modules.json')
+
+
+def directory_mtime(path):
+    """ Returns the modification time of the given directory in nanoseconds
+    or None if the directory does not exist.
+
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_modules(paths):
+    """ Walks the given module paths and returns a tuple with the set of
+    module names found and the modification times of all directories that
+    were visited (including the ones which do not exist).
+
+    Adding or removing a module changes the modification time of the
+    directory that contains it, so these times can be used to tell if the
+    module names are still current.
+
+    """
+    modules = set()
+    mtimes = {}
+
+    def walk(path):
+        mtimes[path] = directory_mtime(path)
+
+        if mtimes[path] is None:
+            return
+
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.name.endswith(BLACKLISTED_EXTENSIONS):
+                continue
+            if entry.name.startswith(BLACKLISTED_PREFIXES):
+                continue
+            if entry.is_dir():
+                walk(entry.path)
+            else:
+                modules.add(os.path.splitext(entry.name)[0])
+
+    for path in paths:
+        walk(path)
+
+    return modules, mtimes
+
+
+class ModuleIndex(object):
+    """ Keeps the names of the available Ansible modules around, so the
+    module paths do not have to be walked again each time the modules are
+    listed.
+
+    The index is keyed on the module paths and the modification times
+    of all directories found in them. If either of those change (e.g. when
+    a module or collection is installed or removed), the paths are scanned
+    again.
+
+    If a cache file is given, the index is additionally persisted to disk,
+    so that new processes may skip the initial scan as well. The index may
+    be used from multiple threads.
+
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.paths = None
+        self.mtimes = None
+        self.names = None
+
+        self.lock = threading.RLock()
+
+    def is_current(self, paths):
+        if self.names is None or self.paths != paths:
+            return False
+
+        for path, mtime in self.mtimes.items():
+            if directory_mtime(path) != mtime:
+                return False
+
+        return True
+
+    def modules(self, paths):
+        """ Returns the set of module names found in the given paths. """
+
+        paths = list(paths)
+
+        with self.lock:
+            if self.is_current(paths):
+                return self.names
+
+            if self.cache_file and self.load() and self.is_current(paths):
+                return self.names
+
+            log.debug(u'scanning module paths {}'.format(paths))
+
+            self.names, self.mtimes = scan_modules(paths)
+            self.paths = paths
+
+            if self.cache_file:
+                self.save()
+
+            return self.names
+
+    def clear(self):
+        with self.lock:
+            self.paths = None
+            self.mtimes = None
+            self.names = None
+
+    def load(self):
+        """ Loads the index from the cache file. Returns True if successful.
+
+        """
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return False
+
+        try:
+            self.paths = list(data['paths'])
+            self.mtimes = dict(data['mtimes'])
+            self.names = set(data['modules'])
+        except (KeyError, TypeError):
+            self.clear()
+            return False
+
+        return True
+
+    def save(self):
+        """ Writes the index to the cache file. The file is replaced
+        atomically, so concurrent processes never read a partial index.
+
+        Failures are logged and otherwise ignored, the cache is only
+        an optimisation.
+
+        """
+        data = {
+            'version': CACHE_VERSION,
+            'paths': self.paths,
+            'mtimes': self.mtimes,
+            'modules': sorted(self.names)
+        }
+
+        directory = os.path.dirname(self.cache_file)
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(temp, self.cache_file)
+            except BaseException:
+                os.unlink(temp)
+                raise
+
+        except OSError as e:
+            log.debug(u'could not write module cache: {}'.format(e))
@@ -1,94 +1,21 @@
-import atexit
-import ansible.constants
-import logging
-import os
-import signal
-import sys
-
-from __main__ import display
-from ansible.executor.task_queue_manager import TaskQueueManager
-from ansible.parsing.dataloader import DataLoader
-from ansible.inventory.manager import InventoryManager
-from ansible.playbook.play import Play
-from ansible.vars.manager import VariableManager
-from contextlib import contextmanager
+import copy
+import threading
+import time
+
 from datetime import datetime
 from pprint import pformat
-from suitable.callback import SilentCallbackModule
+from queue import Queue
+from suitable.callback import SilentCallbackModule, StreamingCallbackModule
 from suitable.common import log
 from suitable.runner_results import RunnerResults
 
-try:
-    from ansible import context
-except ImportError:
-    set_global_context = None
-else:
-    set_global_context = context._init_global_context
-
-
-@contextmanager
-def ansible_verbosity(verbosity):
-    """ Temporarily changes the ansible verbosity. Relies on a single display
-    instance being referenced by the __main__ module.
-
-    This is setup when suitable is imported, though Ansible could already
-    be imported beforehand, in which case the output might not be as verbose
-    as expected.
-
-    To be sure, import suitable before importing ansible. ansible.
-
-    """
-    previous = display.verbosity
-    display.verbosity = verbosity
-    yield
-    display.verbosity = previous
-
-
-@contextmanager
-def environment_variable(key, value):
-    """ Temporarily overrides an environment variable. """
-
-    if key not in os.environ:
-        previous = None
-    else:
-        previous = os.environ[key]
-
-    os.environ[key] = value
-
-    yield
-
-    if previous is None:
-        del os.environ[key]
-    else:
-        os.environ[key] = previous
-
-
-@contextmanager
-def host_key_checking(enable):
-    """ Temporarily disables host_key_checking, which is set globally. """
-
-    def as_string(b):
-        return b and 'True' or 'False'
-
-    with environment_variable('ANSIBLE_HOST_KEY_CHECKING', as_string(enable)):
-        previous = ansible.constants.HOST_KEY_CHECKING
-
-        ansible.constants.HOST_KEY_CHECKING = enable
-        yield
-        ansible.constants.HOST_KEY_CHECKING = previous
-
-
-class SourcelessInventoryManager(InventoryManager):
-    """ A custom inventory manager that turns the source parsing into a noop.
-
-    Without this, Ansible will warn that there are no inventory sources that
-    could be parsed. Naturally we do not have such sources, rendering this
-    warning moot.
-
-    """
-
-    def parse_sources(self, *args, **kwargs):
-        pass
+# these used to live here, keep them importable
+from suitable.execution_context import (  # noqa: F401
+    ansible_verbosity,
+    environment_variable,
+    host_key_checking,
+    SourcelessInventoryManager,
+)
 
 
 class ModuleRunner(object):
@@ -102,28 +29,60 @@ class ModuleRunner(object):
         self.api = None
         self.module_args = None
 
+        # the hosts a call is limited to, None for all hosts
+        self.hosts = None
+
+        # true for calls made through submit, which do not wait for other
+        # calls of the api to finish
+        self.submitted = False
+
+        # the seconds after which a call stops waiting for the hosts, None
+        # for the default of the api
+        self.timeout = None
+
+        # the hosts whose failure a call has recorded with the health
+        # tracker of the api, and whether they were quarantined as a result
+        self.recorded_failures = {}
+
     def __str__(self):
-        """ Return a represenation of the module, including the last
-        run module_args (-> this will end up looking a lot like) an entry
-        in an ansible yaml file.
+        """ Return a represenation of the module, including the module_args
+        of the call (-> this will end up looking a lot like) an entry in an
+        ansible yaml file.
 
         """
         return "{}: {}".format(self.module_name, self.module_args)
 
     @property
     def is_hooked_up(self):
-        return self.api is not None and hasattr(self.api, self.module_name)
+        return self.api is not None and self.module_name in vars(self.api)
 
     def hookup(self, api):
         """ Hooks this module up to the given api. """
 
-        assert not hasattr(api, self.module_name), """
+        # avoid hasattr on the instance, which would resolve lazy modules
+        conflict = self.module_name in vars(api) \
+            or hasattr(type(api), self.module_name)
+
+        assert not conflict, """
             '{}' conflicts with existing attribute
         """.format(self.module_name)
 
         self.api = api
 
-        setattr(api, self.module_name, self.execute)
+        setattr(api, self.module_name, self)
+
+    def __call__(self, *args, **kwargs):
+        return self.execute(*args, **kwargs)
+
+    def limit(self, hosts):
+        """ Returns a copy of this runner, whose calls are limited to the
+        given hosts (see :meth:`suitable.api.Api.on`).
+
+        """
+        runner = copy.copy(self)
+        runner.hosts = self.api.resolve_servers(hosts)
+
+        return runner
 
     def get_module_args(self, args, kwargs):
         # escape equality sign, until this is fixed:
@@ -135,6 +94,17 @@ class ModuleRunner(object):
 
         return u' '.join((args, kwargs)).strip()
 
+    def get_task(self, module_args):
+        """ Returns the Ansible task running this module. """
+
+        return {
+            'action': {
+                'module': self.module_name,
+                'args': module_args,
+            },
+            'environment': self.api.environment,
+        }
+
     def execute(self, *args, **kwargs):
         """ Puts args and kwargs in a way ansible can understand. Calls ansible
         and interprets the result.
@@ -142,137 +112,383 @@ class ModuleRunner(object):
         """
         assert self.is_hooked_up, "the module should be hooked up to the api"
 
-        if set_global_context:
-            set_global_context(self.api.options)
+        hosts = self.get_call_hosts(kwargs)
+        timeout = self.get_call_timeout(kwargs)
+        module_args = self.get_call_args(args, kwargs)
+
+        # the runner is shared by all calls of a module (possibly from
+        # different threads), so each call works with a copy of its own
+        return self.for_call(module_args, hosts, timeout).run()
+
+    def stream(self, *args, **kwargs):
+        """ Runs the module like :meth:`execute`, but returns an iterator,
+        which yields a tuple of server and :class:`RunnerResults` for each
+        server, as soon as the server is done::
+
+            for server, result in api.shell.stream('uptime'):
+                print(server, result.stdout())
+
+        Results are evaluated as they are yielded, so errors are raised
+        when the failing server is reached. The play keeps running in the
+        background, if the iterator is not exhausted it is waited for when
+        the iterator is closed.
+
+        """
+        assert self.is_hooked_up, "the module should be hooked up to the api"
+        assert self.api._batch is None, "batched calls cannot be streamed"
+
+        hosts = self.get_call_hosts(kwargs)
+        timeout = self.get_call_timeout(kwargs)
+        module_args = self.get_call_args(args, kwargs)
+
+        return self.for_call(module_args, hosts, timeout).run_streaming()
+
+    def submit(self, *args, **kwargs):
+        """ Runs the module like :meth:`execute`, but in the background.
+        Returns a :class:`concurrent.futures.Future`, which resolves to the
+        :class:`RunnerResults` of the call::
+
+            web = api.on('web*').apt.submit(upgrade='dist')
+            db = api.on('db*').apt.submit(upgrade='dist')
+
+            web_result, db_result = api.gather(web, db)
+
+        The calls run in the executor of the api (see
+        :meth:`suitable.api.Api.submit`). Errors are raised when the result
+        of the future is retrieved. The valid return codes in effect when
+        the call is submitted apply.
+
+        """
+        assert self.is_hooked_up, "the module should be hooked up to the api"
+        assert self.api._batch is None, "batched calls cannot be submitted"
+
+        hosts = self.get_call_hosts(kwargs)
+        timeout = self.get_call_timeout(kwargs)
+        module_args = self.get_call_args(args, kwargs)
+
+        call = self.for_call(module_args, hosts, timeout)
+        call.submitted = True
+
+        valid_return_codes = self.api._valid_return_codes
+
+        def run():
+            with self.api.valid_return_codes(*valid_return_codes):
+                return call.run()
+
+        return self.api.submit(run)
+
+    def get_call_hosts(self, kwargs):
+        """ Pops the hosts a call is limited to from the keyword arguments
+        of the call (``_hosts``), if any.
+
+        """
+        hosts = kwargs.pop('_hosts', None)
+
+        if hosts is None:
+            return self.hosts
+
+        return self.api.resolve_servers(hosts)
+
+    def get_call_timeout(self, kwargs):
+        """ Pops the timeout of a call from the keyword arguments of the
+        call (``_timeout``), if any. See :meth:`get_timeout`.
+
+        """
+        timeout = kwargs.pop('_timeout', None)
+
+        if timeout is None:
+            return self.timeout
+
+        return timeout
+
+    def get_timeout(self):
+        """ Returns the seconds after which the call stops waiting for
+        the hosts, or None.
+
+        """
+        if self.timeout is not None:
+            return self.timeout
+
+        return self.api.timeout
+
+    def get_call_args(self, args, kwargs):
 
         # legacy key=value pairs shorthand approach
         if args:
-            self.module_args = module_args = self.get_module_args(args, kwargs)
+            return self.get_module_args(args, kwargs)
+
+        return kwargs
+
+    def for_call(self, module_args, hosts=None, timeout=None):
+        """ Returns a copy of this runner for a single call of the module
+        with the given arguments, optionally limited to the given hosts
+        and the given number of seconds.
+
+        """
+        call = copy.copy(self)
+        call.module_args = module_args
+
+        if hosts is not None:
+            call.hosts = hosts
+
+        if timeout is not None:
+            call.timeout = timeout
+
+        return call
+
+    def run(self):
+        """ Runs the module with the arguments of this call. """
+
+        module_args = self.module_args
+
+        if self.api._batch is not None:
+            log.info(u'batching - {module_name}: {module_args}'.format(
+                module_name=self.module_name,
+                module_args=module_args
+            ))
+
+            self.api._batch.add(self, module_args)
+            return None
+
+        log.info(
+            u'running {}'.format(u'- {module_name}: {module_args}'.format(
+                module_name=self.module_name,
+                module_args=module_args
+            ))
+        )
+
+        instrumentation = self.api.instrumentation
+
+        with instrumentation.span('suitable.call', module=self.module_name):
+            start = datetime.utcnow()
+            callback = self.run_play(module_args)
+
+            log.debug(u'took {} to complete'.format(
+                datetime.utcnow() - start))
+
+            with instrumentation.span('suitable.evaluate'):
+                return self.evaluate_results(callback)
+
+    def run_play(self, module_args):
+        """ Runs the play of this call and returns the callback with the
+        results. Memoized results are added without running the module.
+
+        """
+        callback = SilentCallbackModule(self.api.result_retention)
+        task = self.get_task(module_args)
+        memoization = self.api.memoization
+        context = self.api.get_execution_context()
+
+        if memoization is None or not memoization.applies(self.module_name):
+            self.run_task(context, task, callback, self.hosts)
+            return callback
+
+        key = memoization.key(self.api, self.module_name, module_args)
+
+        if self.hosts is None:
+            hosts = list(self.api.inventory)
         else:
-            self.module_args = module_args = kwargs
-
-        loader = DataLoader()
-        inventory_manager = SourcelessInventoryManager(loader=loader)
-
-        for host, host_variables in self.api.inventory.items():
-            inventory_manager._inventory.add_host(host, group='all')
-            for key, value in host_variables.items():
-                inventory_manager._inventory.set_variable(host, key, value)
-
-        for key, value in self.api.options.extra_vars.items():
-            inventory_manager._inventory.set_variable('all', key, value)
-
-        variable_manager = VariableManager(
-            loader=loader, inventory=inventory_manager)
-
-        play_source = {
-            'name': "Suitable Play",
-            'hosts': 'all',
-            'gather_facts': 'no',
-            'tasks': [{
-                'action': {
-                    'module': self.module_name,
-                    'args': module_args,
-                },
-                'environment': self.api.environment,
-            }]
+            hosts = self.hosts
+
+        host_keys = memoization.host_keys(self.api, hosts)
+        memoized = memoization.get(key, hosts, host_keys)
+
+        if len(memoized) < len(hosts):
+            # without memoized results, the call runs as usual
+            if memoized or self.hosts is not None:
+                missing = [host for host in hosts if host not in memoized]
+            else:
+                missing = None
+
+            self.run_task(context, task, callback, missing)
+            memoization.put(key, callback.contacted, host_keys)
+
+        if memoized:
+            log.debug(u'{} memoized results'.format(len(memoized)))
+            callback.contacted.update(memoized)
+
+        return callback
+
+    def run_task(self, context, task, callback, hosts):
+        """ Runs the task on the given hosts (or all hosts) in the given
+        context, skipping quarantined hosts.
+
+        Unreachable hosts are retried according to the retry policy of the
+        api. If the call times out, the hosts without result are recorded
+        as timed out.
+
+        """
+        limit = hosts
+
+        if hosts is None:
+            hosts = list(self.api.inventory)
+
+        health = self.api.health
+
+        if health is not None:
+            quarantined = health.quarantined()
+
+            if not quarantined.isdisjoint(hosts):
+                hosts = limit = [h for h in hosts if h not in quarantined]
+
+        timeout = self.get_timeout()
+        retry = self.api.retry
+        attempts = retry.attempts if retry is not None else 1
+
+        for attempt in range(1, attempts + 1):
+            timed_out = context.run(
+                [task], callback, limit, not self.submitted, timeout=timeout)
+
+            if timed_out or not callback.unreachable or attempt == attempts:
+                break
+
+            limit = list(callback.unreachable)
+            delay = retry.delay(attempt)
+
+            log.info(u'retrying {} unreachable hosts in {:.1f}s'.format(
+                len(limit), delay))
+
+            time.sleep(delay)
+
+            for host in limit:
+                del callback.unreachable[host]
+
+        if timed_out:
+            for host in hosts:
+                if host in callback.contacted or host in callback.unreachable:
+                    continue
+
+                callback.timed_out[host] = self.get_timed_out_result(timeout)
+
+        if health is not None:
+            recorded = self.recorded_failures = {}
+
+            # successes are recorded once the results are evaluated
+            for host in hosts:
+                if host in callback.unreachable:
+                    recorded[host] = health.record_failure(host)
+
+    def get_timed_out_result(self, timeout):
+        return {
+            'timed_out': True,
+            'timeout': timeout,
+            'msg': u'{} did not finish within {} seconds'.format(
+                self.module_name, timeout)
         }
 
+    def run_streaming(self):
+        """ Runs the module with the arguments of this call, yielding the
+        results of each server as they come in.
+
+        """
+
+        # the settings in effect when the call is made apply, not the ones
+        # in effect when the results are consumed
+        task = self.get_task(self.module_args)
+        hosts = self.hosts
+        valid_return_codes = self.api._valid_return_codes
+        context = self.api.get_execution_context()
+        timeout = self.get_timeout()
+
+        log.info(u'streaming - {module_name}: {module_args}'.format(
+            module_name=self.module_name,
+            module_args=self.module_args
+        ))
+
+        return self.stream_results(
+            context, task, hosts, valid_return_codes, timeout)
+
+    def stream_results(self, context, task, hosts, valid_return_codes,
+                       timeout=None):
+        events = Queue()
+        callback = StreamingCallbackModule(events, self.api.result_retention)
+
+        if hosts is None:
+            remaining = set(self.api.inventory)
+        else:
+            remaining = set(hosts)
+
+        # quarantined hosts are skipped by the play
+        if self.api.health is not None:
+            remaining -= self.api.health.quarantined()
+
+        def play():
+            try:
+                if context.run([task], callback, hosts, timeout=timeout):
+                    events.put(('timeout', None, None))
+            except Exception as e:
+                events.put(('error', None, e))
+            finally:
+                events.put(('done', None, None))
+
+        thread = threading.Thread(target=play, name='suitable-stream')
+        thread.daemon = True
+        thread.start()
+
         try:
-            start = datetime.utcnow()
-            task_queue_manager = None
-            callback = SilentCallbackModule()
-
-            play = Play.load(
-                play_source,
-                variable_manager=variable_manager,
-                loader=loader,
-            )
-
-            if self.api.strategy:
-                play.strategy = self.api.strategy
-
-            log.info(
-                u'running {}'.format(u'- {module_name}: {module_args}'.format(
-                    module_name=self.module_name,
-                    module_args=module_args
-                ))
-            )
-
-            # ansible uses various levels of verbosity (from -v to -vvvvvv)
-            # offering various amounts of debug information
-            #
-            # we keep it a bit simpler by activating all of it during debug,
-            # and falling back to the default of 0 otherwise
-            verbosity = self.api.options.verbosity == logging.DEBUG and 6 or 0
-
-            with ansible_verbosity(verbosity):
-
-                # host_key_checking is special, since not each connection
-                # plugin handles it the same way, we need to apply both
-                # environment variable and Ansible constant when running a
-                # command in the runner to be successful
-                with host_key_checking(self.api.host_key_checking):
-                    kwargs = dict(
-                        inventory=inventory_manager,
-                        variable_manager=variable_manager,
-                        loader=loader,
-                        options=self.api.options,
-                        passwords=getattr(self.api.options, 'passwords', {}),
-                        stdout_callback=callback
-                    )
-
-                    if set_global_context:
-                        del kwargs['options']
-
-                    task_queue_manager = TaskQueueManager(**kwargs)
-
-                    try:
-                        task_queue_manager.run(play)
-                    except SystemExit:
-
-                        # Mitogen forks our process and exits it in one
-                        # instance before returning
-                        #
-                        # This is fine, but it does lead to a very messy exit
-                        # by py.test which will essentially return with a test
-                        # that is first successful and then failed as each
-                        # forked process dies.
-                        #
-                        # To avoid this we commit suicide if we are run inside
-                        # a pytest session. Normally this would just result
-                        # in a exit code of zero, which is good.
-                        if 'pytest' in sys.modules:
-                            try:
-                                atexit._run_exitfuncs()
-                            except Exception:
-                                pass  # nosec
-                            os.kill(os.getpid(), signal.SIGKILL)
-
-                        raise
-        finally:
-            if task_queue_manager is not None:
-                task_queue_manager.cleanup()
+            while True:
+                event, server, result = events.get()
+
+                if event == 'done':
+                    break
+
+                if event == 'error':
+                    raise result
 
-            if set_global_context:
-                # Ansible 2.8 introduces a global context which persists
-                # during the lifetime of the process - for Suitable this
-                # singleton/cache needs to be cleared after each call
-                # to make sure that API calls do not carry over state.
-                #
-                # The docs hint at a future inclusion of local contexts, which
-                # would of course be preferable.
-                from ansible.utils.context_objects import GlobalCLIArgs
-                GlobalCLIArgs._Singleton__instance = None
+                if event == 'timeout':
+                    for server in sorted(remaining):
+                        result = self.get_timed_out_result(timeout)
+                        self.evaluate_timed_out(server, result)
 
-        log.debug(u'took {} to complete'.format(datetime.utcnow() - start))
+                        yield server, RunnerResults({
+                            'contacted': {},
+                            'unreachable': {},
+                            'timed_out': {server: result}
+                        })
+
+                    continue
 
-        return self.evaluate_results(callback)
+                remaining.discard(server)
+
+                with self.api.valid_return_codes(*valid_return_codes):
+                    if event == 'unreachable':
+                        self.evaluate_unreachable(server, result)
+                        results = {'contacted': {}, 'unreachable': {
+                            server: result
+                        }, 'timed_out': {}}
+                    else:
+                        self.evaluate_contacted(server, result)
+                        results = {'contacted': {
+                            server: result['result']
+                        }, 'unreachable': {}, 'timed_out': {}}
+
+                yield server, RunnerResults(results)
+        finally:
+            thread.join()
 
     def ignore_further_calls_to_server(self, server):
-        """ Takes a server out of the list. """
+        """ Takes a server out of the list. If the api keeps track of the
+        health of its servers, the failure is recorded instead and the
+        server is only skipped once it is quarantined.
+
+        """
+        health = self.api.health
+
+        if health is not None:
+            if server in self.recorded_failures:
+                quarantined = self.recorded_failures[server]
+            else:
+                quarantined = health.record_failure(server)
+
+            if quarantined:
+                log.error(u'quarantining {}'.format(server))
+
+            return
+
         log.error(u'ignoring further calls to {}'.format(server))
-        del self.api.inventory[server]
+
+        # the server might have been removed by a concurrent call already
+        self.api.inventory.pop(server, None)
 
     def trigger_event(self, server, method, args):
         try:
@@ -288,44 +504,70 @@ class ModuleRunner(object):
         """ prepare the result of runner call for use with RunnerResults. """
 
         for server, result in callback.unreachable.items():
-            log.error(u'{} could not be reached'.format(server))
-            log.debug(u'ansible-output =>\n{}'.format(pformat(result)))
-
-            if self.api.ignore_unreachable:
-                continue
+            self.evaluate_unreachable(server, result)
 
-            self.trigger_event(server, 'on_unreachable_host', (
-                self, server
-            ))
+        for server, result in callback.timed_out.items():
+            self.evaluate_timed_out(server, result)
 
         for server, answer in callback.contacted.items():
+            self.evaluate_contacted(server, answer)
 
-            success = answer['success']
-            result = answer['result']
+        return self.collect_results(callback)
 
-            # none of the modules in our tests hit the 'failed' result
-            # codepath (which seems to not be implemented by all modules)
-            # seo we ignore this branch since it's rather trivial
-            if result.get('failed'):  # pragma: no cover
-                success = False
+    def evaluate_unreachable(self, server, result):
+        log.error(u'{} could not be reached'.format(server))
+        log.debug(u'ansible-output =>\n{}'.format(pformat(result)))
 
-            if 'rc' in result:
-                if self.api.is_valid_return_code(result['rc']):
-                    success = True
+        if self.api.ignore_unreachable:
+            return
 
-            # Add success to result
-            result['success'] = success
+        self.trigger_event(server, 'on_unreachable_host', (
+            self, server
+        ))
 
-            if not success:
-                log.error(u'{} failed on {}'.format(self, server))
-                log.debug(u'ansible-output =>\n{}'.format(pformat(result)))
+    def evaluate_timed_out(self, server, result):
+        log.error(u'{} timed out on {}'.format(self, server))
 
-                if self.api.ignore_errors:
-                    continue
+        self.trigger_event(server, 'on_host_timeout', (
+            self, server, result['timeout']
+        ))
+
+    def evaluate_contacted(self, server, answer):
+        success = answer['success']
+        result = answer['result']
+
+        # none of the modules in our tests hit the 'failed' result
+        # codepath (which seems to not be implemented by all modules)
+        # seo we ignore this branch since it's rather trivial
+        if result.get('failed'):  # pragma: no cover
+            success = False
+
+        if 'rc' in result:
+            if self.api.is_valid_return_code(result['rc']):
+                success = True
 
-                self.trigger_event(server, 'on_module_error', (
-                    self, server, result
-                ))
+        # Add success to result
+        result['success'] = success
+
+        if success and self.api.health is not None:
+            self.api.health.record_success(server)
+
+        if not success:
+            log.error(u'{} failed on {}'.format(self, server))
+            log.debug(u'ansible-output =>\n{}'.format(pformat(result)))
+
+            if self.api.ignore_errors:
+                return
+
+            self.trigger_event(server, 'on_module_error', (
+                self, server, result
+            ))
+
+    def collect_results(self, callback):
+        """ Returns the results of the callback as RunnerResults, without
+        evaluating them.
+
+        """
 
         # XXX this is a weird structure because RunnerResults still works
         # like it did with Ansible 1.x, where the results where structured
@@ -338,5 +580,6 @@ class ModuleRunner(object):
             'unreachable': {
                 server: result
                 for server, result in callback.unreachable.items()
-            }
+            },
+            'timed_out': dict(callback.timed_out)
         })
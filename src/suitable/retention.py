@@ -0,0 +1,164 @@
+import mmap
+import os
+import tempfile
+import weakref
+
+
+# keys which are needed to evaluate a result (or to cache facts) and are
+# always retained
+ESSENTIAL_KEYS = (
+    'rc', 'failed', 'changed', 'skipped', 'unreachable', 'ansible_facts'
+)
+
+# keys explaining why a module failed, retained for failed results
+ERROR_KEYS = ('msg', 'stderr', 'module_stderr')
+
+# keys holding the output of a module, which may grow large
+OUTPUT_KEYS = ('stdout', 'stderr')
+
+# keys duplicating the output as list of lines
+LINES_KEYS = ('stdout_lines', 'stderr_lines')
+
+
+class SpilledOutput(object):
+    """ References module output which was written to a temporary file.
+
+    The output is read from the file when it is converted to a string, or
+    may be mapped into memory using :meth:`mmap`. The file is removed once
+    the reference is garbage collected.
+
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+        self._remove = weakref.finalize(self, remove_file, path)
+
+    def __repr__(self):
+        return '<SpilledOutput {} ({} bytes)>'.format(self.path, self.size)
+
+    def __str__(self):
+        return self.read()
+
+    def __deepcopy__(self, memo):
+        # the file is not copied, copies share the reference
+        return self
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def mmap(self):
+        """ Returns a read-only memory map of the output (in bytes). """
+
+        with open(self.path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def splitlines(self):
+        return self.read().splitlines()
+
+
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class ResultRetention(object):
+    """ Limits the memory used by the results of module calls.
+
+    By default, Ansible's results are kept as they are. With hundreds of
+    hosts returning large outputs, this adds up quickly, so an api may be
+    told to retain less::
+
+        api = Api(servers, result_retention=ResultRetention(
+            max_output=64 * 1024,
+            drop_lines=True,
+        ))
+
+    :param keys:
+        The keys of the result to retain. The keys needed to evaluate the
+        result (e.g. ``rc`` and ``failed``) are always retained, as are the
+        keys explaining a failure (e.g. ``msg`` and ``stderr``) of failed
+        results.
+
+    :param max_output:
+        The number of characters of ``stdout`` and ``stderr`` to retain.
+        Longer output is truncated, and the names of the truncated keys are
+        listed in ``truncated``.
+
+    :param drop_lines:
+        Drops ``stdout_lines`` and ``stderr_lines``, which duplicate the
+        output. :class:`suitable.runner_results.RunnerResults` still
+        provides them, by splitting the output when they are requested.
+
+    :param spill_threshold:
+        Output longer than this number of characters is written to a
+        temporary file and replaced by a :class:`SpilledOutput` referencing
+        it. Applies before ``max_output``, so spilled output is never
+        truncated.
+
+    :param spill_directory:
+        The directory of the temporary files (defaults to the system's
+        temporary directory).
+
+    """
+
+    def __init__(self, keys=None, max_output=None, drop_lines=False,
+                 spill_threshold=None, spill_directory=None):
+
+        if keys is not None:
+            keys = set(keys).union(ESSENTIAL_KEYS)
+
+        self.keys = keys
+        self.max_output = max_output
+        self.drop_lines = drop_lines
+        self.spill_threshold = spill_threshold
+        self.spill_directory = spill_directory
+
+    def apply(self, result):
+        """ Returns the given result with the retention applied. """
+
+        if self.keys is not None:
+            failed = result.get('failed') or result.get('unreachable')
+
+            result = {
+                k: v for k, v in result.items()
+                if k in self.keys or failed and k in ERROR_KEYS
+            }
+        else:
+            result = dict(result)
+
+        if self.drop_lines:
+            for key in LINES_KEYS:
+                result.pop(key, None)
+
+        for key in OUTPUT_KEYS:
+            value = result.get(key)
+
+            if not isinstance(value, str):
+                continue
+
+            if self.spill_threshold is not None \
+                    and len(value) > self.spill_threshold:
+                result[key] = self.spill(value)
+
+            elif self.max_output is not None \
+                    and len(value) > self.max_output:
+                result[key] = value[:self.max_output]
+                result.setdefault('truncated', []).append(key)
+
+        return result
+
+    def spill(self, value):
+        fd, path = tempfile.mkstemp(
+            prefix='suitable-', suffix='.out', dir=self.spill_directory)
+
+        data = value.encode('utf-8')
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        return SpilledOutput(path, len(data))
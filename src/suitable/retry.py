@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """ Re-runs a module call on the hosts which could not be reached, up
+    to ``attempts`` times in total, waiting between attempts::
+
+        api = Api(servers, retry=RetryPolicy(attempts=4, backoff=2))
+
+    The wait grows exponentially (``backoff``, ``2 * backoff``,
+    ``4 * backoff``, ...) up to ``max_backoff`` seconds. With ``jitter``,
+    each wait is shortened by a random fraction of up to that size, so
+    retries of many calls do not all happen at the same time.
+
+    Hosts which were reached are not run again, even if the module failed.
+    Only single calls are retried, not batches, pipelines or streams.
+
+    """
+
+    def __init__(self, attempts=3, backoff=1.0, max_backoff=30.0,
+                 jitter=0.5):
+        assert attempts >= 1, "at least one attempt is needed"
+        assert 0 <= jitter <= 1, "the jitter is a fraction of the wait"
+
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """ Returns the seconds to wait after the given attempt (starting
+        with 1).
+
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+        # not used for anything security related
+        return delay * (1 - self.jitter * random.random())  # nosec
+
+
+class HostHealth(object):
+    """ Keeps track of the hosts which could not be reached, like a circuit
+    breaker: once a host failed ``threshold`` times in a row, it is
+    quarantined for ``cooldown`` seconds, during which module calls skip
+    it. Afterwards, the host is tried again. A single success resets it,
+    another failure sends it back into quarantine::
+
+        api = Api(servers, health=HostHealth(threshold=2, cooldown=300))
+
+    Without health tracker, hosts causing an error are taken out of the
+    inventory for good. With it, the error counts as a failure instead.
+
+    """
+
+    def __init__(self, threshold=1, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        # host -> consecutive failures
+        self.failures = {}
+
+        # host -> end of quarantine (monotonic)
+        self.quarantine_ends = {}
+
+        self.lock = threading.Lock()
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.quarantine_ends.pop(host, None)
+
+    def record_failure(self, host):
+        """ Records a failure of the given host, which is quarantined once
+        the threshold is reached. Returns True if that is the case.
+
+        """
+        with self.lock:
+            failures = self.failures[host] = self.failures.get(host, 0) + 1
+
+            if failures < self.threshold:
+                return False
+
+            self.quarantine_ends[host] = time.monotonic() + self.cooldown
+            return True
+
+    def quarantine(self, host):
+        """ Quarantines the given host right away. """
+
+        with self.lock:
+            self.failures[host] = max(
+                self.failures.get(host, 0), self.threshold)
+            self.quarantine_ends[host] = time.monotonic() + self.cooldown
+
+    def release(self, host=None):
+        """ Ends the quarantine of the given host, or of all hosts. """
+
+        with self.lock:
+            if host is None:
+                self.failures.clear()
+                self.quarantine_ends.clear()
+            else:
+                self.failures.pop(host, None)
+                self.quarantine_ends.pop(host, None)
+
+    def quarantined(self):
+        """ Returns the hosts currently in quarantine. """
+
+        now = time.monotonic()
+
+        with self.lock:
+            for host, end in list(self.quarantine_ends.items()):
+                if end <= now:
+                    del self.quarantine_ends[host]
+
+            return set(self.quarantine_ends)
+
+    def is_quarantined(self, host):
+        return host in self.quarantined()
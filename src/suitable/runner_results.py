@@ -1,3 +1,67 @@
+from collections import Counter
+from functools import partial
+from types import MappingProxyType
+from suitable.retention import LINES_KEYS, OUTPUT_KEYS, SpilledOutput
+
+
+def hashable(value):
+    """ Returns the given value in a form usable as dict key. Lists (e.g.
+    ``stdout_lines``) are turned into tuples.
+
+    """
+    if isinstance(value, list):
+        return tuple(hashable(v) for v in value)
+
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError(
+            "cannot group by values of type {}".format(type(value).__name__)
+        ) from None
+
+    return value
+
+
+def get_value(result, key):
+    """ Returns the value of the given key in the result of a single server,
+    or raises a KeyError.
+
+    """
+    if key in result:
+        value = result[key]
+
+        # output spilled to disk is read when requested
+        if isinstance(value, SpilledOutput):
+            return value.read()
+
+        return value
+
+    # the lines might have been dropped to save memory
+    if key in LINES_KEYS:
+        output = result.get(key[:-len('_lines')])
+
+        if output is not None:
+            return output.splitlines()
+
+    raise KeyError(key)
+
+
+class Accessor(object):
+    """ Provides the accessor of a common key directly on the class, which
+    spares the lookup through :meth:`RunnerResults.__getattr__`.
+
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, results, owner=None):
+        if results is None:
+            return self
+
+        return results.__getattr__(self.key)
+
+
 class RunnerResults(dict):
     """ Wraps the results of parsed module_runner output. The result may
     be used just like it is in Ansible:
@@ -8,25 +72,183 @@ class RunnerResults(dict):
 
     result.rc('server')
 
+    To get the value of a key for all contacted servers at once, use
+    columns:
+
+    result.column('rc')  # -> {'server': 0, ...}
+
+    Columns are built on first access and kept, so the results should not
+    be modified afterwards. They back the query helpers:
+
+    result.filter(changed=True)  # -> RunnerResults of changed servers
+    result.count_by('rc')  # -> Counter({0: 998, 1: 2})
+    result.group_by('stdout')  # -> {'foo': ('server', ...), ...}
+    result.hosts_where(lambda r: 'error' in r['stdout'])  # -> ('server', )
+
     """
 
+    __slots__ = ('_accessors', '_columns')
+
     def __init__(self, results):
         self.update(results)
 
+        self._accessors = {}
+        self._columns = {}
+
     def __getattr__(self, key):
-        return lambda server=None: self.acquire(server, key)
+        # only called for attributes which do not exist, private ones are
+        # not looked up in the results (e.g. slots that are not set yet)
+        if key.startswith('_'):
+            raise AttributeError(key)
+
+        # accessors are kept, so repeated calls do not create new ones
+        accessor = self._accessors.get(key)
+
+        if accessor is None:
+            accessor = self._accessors[key] = partial(self._acquire, key)
+
+        return accessor
+
+    # keys found in the results of most modules, which are accessed often
+    rc = Accessor('rc')
+    changed = Accessor('changed')
+    failed = Accessor('failed')
+    success = Accessor('success')
+    msg = Accessor('msg')
+    stdout = Accessor('stdout')
+    stderr = Accessor('stderr')
+    stdout_lines = Accessor('stdout_lines')
+    stderr_lines = Accessor('stderr_lines')
+
+    @property
+    def hosts(self):
+        """ The contacted servers, in the order their results came in. """
+
+        return tuple(self['contacted'])
+
+    def column(self, key):
+        """ Returns a read-only mapping of contacted servers to the value of
+        the given key. Servers without the key are left out.
+
+        """
+        column = self._columns.get(key)
+
+        if column is None:
+            contacted = self['contacted']
+            values = {s: r[key] for s, r in contacted.items() if key in r}
+
+            # the lines might have been dropped to save memory
+            if key in LINES_KEYS and len(values) < len(contacted):
+                for server, result in contacted.items():
+                    if server not in values:
+                        try:
+                            values[server] = get_value(result, key)
+                        except KeyError:
+                            pass
+
+            # output spilled to disk is read when requested
+            if key in OUTPUT_KEYS:
+                for server, value in values.items():
+                    if isinstance(value, SpilledOutput):
+                        values[server] = value.read()
+
+            column = self._columns[key] = MappingProxyType(values)
+
+        return column
 
     def acquire(self, server, key):
+        return self._acquire(key, server)
+
+    def _acquire(self, key, server=None):
+        contacted = self['contacted']
 
         # if no server is given and exactly one contacted server exists
         # return the value of said server directly
-        if server is None and len(self['contacted']) == 1:
-            server = next((k for k in self['contacted'].keys()), None)
+        if server is None and len(contacted) == 1:
+            server, = contacted
 
-        if server not in self['contacted']:
+        if server not in contacted:
             raise KeyError("{} could not be contacted".format(server))
 
-        if key not in self['contacted'].get(server, {}):
-            raise AttributeError
+        try:
+            return get_value(contacted[server], key)
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def filter(self, **criteria):
+        """ Returns the results of the contacted servers whose values match
+        the given criteria::
+
+            result.filter(changed=True, rc=0)
+
+        """
+        servers = self['contacted'].keys()
+
+        # narrow down the servers one column at a time
+        for key, value in criteria.items():
+            column = self.column(key)
+            servers = [
+                s for s in servers if s in column and column[s] == value
+            ]
+
+        return self.subset(servers)
+
+    def subset(self, servers):
+        """ Returns the results of the given contacted servers. """
+
+        contacted = self['contacted']
+
+        return RunnerResults({
+            'contacted': {server: contacted[server] for server in servers},
+            'unreachable': {},
+            'timed_out': {}
+        })
+
+    def hosts_where(self, predicate):
+        """ Returns the contacted servers for which the given predicate is
+        true. The predicate is called with the result of each server.
+
+        """
+        return tuple(
+            server for server, result in self['contacted'].items()
+            if predicate(result)
+        )
+
+    def group_by(self, key):
+        """ Returns a dict of values of the given key, with the servers
+        sharing each value. Servers without the key are left out. Lists
+        are turned into tuples.
+
+        """
+        groups = {}
+
+        for server, value in self.column(key).items():
+            groups.setdefault(hashable(value), []).append(server)
+
+        return {value: tuple(servers) for value, servers in groups.items()}
+
+    def count_by(self, key):
+        """ Returns a :class:`collections.Counter` of the values of the
+        given key. Servers without the key are left out. Lists are turned
+        into tuples.
+
+        """
+        return Counter(hashable(v) for v in self.column(key).values())
+
+    def array(self, key, default=None):
+        """ Returns the values of the given key as NumPy array, in the
+        order of :attr:`hosts`. Servers without the key get the default.
+
+        Requires NumPy, which is not installed by default.
+
+        """
+        try:
+            import numpy
+        except ImportError as err:  # pragma: no cover
+            raise RuntimeError(
+                "NumPy could not be found. Is it installed?"
+            ) from err
+
+        column = self.column(key)
 
-        return self['contacted'][server][key]
+        return numpy.array([column.get(h, default) for h in self.hosts])
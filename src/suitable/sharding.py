@@ -0,0 +1,194 @@
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from suitable import execution_context
+from suitable.callback import RecordingCallbackModule, replay
+from suitable.common import log
+from suitable.execution_context import ExecutionContext, GlobalState
+from suitable.instrumentation import Instrumentation
+
+
+# the api, tasks, strategy and timeout of the sharded run, as inherited by
+# the shard processes
+SHARD = {}
+
+
+def partition(servers, shards):
+    """ Splits the given servers into at most the given number of shards,
+    of (nearly) equal size.
+
+    """
+    servers = list(servers)
+    shards = min(shards, len(servers))
+
+    return [servers[i::shards] for i in range(shards)]
+
+
+class RecordingForkPolicy(object):
+    """ Stands in for the fork policy of the api in a shard process. Forks
+    are chosen by the policy, but the observations are recorded, to be
+    passed on to the policy of the calling process.
+
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.observations = []
+
+    def choose(self, hosts):
+        return self.policy.choose(hosts)
+
+    def observe(self, hosts, forks, seconds, cpu_seconds):
+        self.observations.append((hosts, forks, seconds, cpu_seconds))
+
+
+def start_shard(api, tasks, strategy, timeout):
+    """ Sets up a shard process, which is forked from the process making
+    the module call, so the api does not have to be pickled.
+
+    """
+    SHARD['api'] = api
+    SHARD['inventory'] = dict(api.inventory)
+    SHARD['instrumented'] = bool(api.instrumentation)
+    SHARD['fork_policy'] = api.fork_policy
+    SHARD['tasks'] = tasks
+    SHARD['strategy'] = strategy
+    SHARD['timeout'] = timeout
+
+    # the state was inherited from the parent, where other threads might
+    # have been using it while the shard was forked
+    execution_context.GLOBAL_STATE = GlobalState()
+
+
+def run_shard(servers):
+    """ Runs the tasks against the given servers and returns a dict with
+    what the calling process needs to know about the play:
+
+    - ``events``: the events of the play, to be replayed
+    - ``timed_out``: whether the play timed out
+    - ``pool``: the usage of the connection pool, if any
+    - ``spans``: the spans measured by the instrumentation, if any
+    - ``observations``: the observations of the fork policy
+
+    """
+    api = SHARD['api']
+    inventory = SHARD['inventory']
+    pool = api.connection_pool
+
+    # the hooks were inherited from the calling process, but they would be
+    # called in this process, so the spans are recorded instead
+    spans = []
+
+    if SHARD['instrumented']:
+        api.instrumentation = Instrumentation([spans.append])
+
+    fork_policy = api.fork_policy = RecordingForkPolicy(SHARD['fork_policy'])
+
+    if pool is not None:
+        hits, misses = pool.hits, pool.misses
+
+    # the api is a copy of the parent's, so its inventory may be changed,
+    # but a worker process may run more than one shard, so each shard
+    # starts from the original inventory
+    api.inventory.clear()
+    api.inventory.update((server, inventory[server]) for server in servers)
+
+    callback = RecordingCallbackModule()
+    timed_out = ExecutionContext(api).run(
+        SHARD['tasks'], callback,
+        strategy=SHARD['strategy'], timeout=SHARD['timeout'])
+
+    result = {
+        'events': callback.events,
+        'timed_out': timed_out,
+        'pool': None,
+        'spans': spans,
+        'observations': fork_policy.observations,
+    }
+
+    if pool is not None:
+        result['pool'] = (
+            dict(pool.connections), pool.hits - hits, pool.misses - misses)
+
+    return result
+
+
+class ShardedExecutionContext(object):
+    """ Runs plays like :class:`suitable.execution_context.ExecutionContext`,
+    but splits the inventory into shards and runs the play of each shard
+    in a process of its own.
+
+    Ansible runs a play with a limited number of forks and aggregates all
+    results in a single process, which becomes the bottleneck with
+    thousands of hosts. With shards, the results are aggregated in the shard
+    processes and the events of each play are replayed to the callback of
+    the calling process once the shard is done, where the results are
+    evaluated as usual.
+
+    The shard processes are forked, which is only supported on POSIX
+    platforms.
+
+    """
+
+    def __init__(self, api, shards):
+        self.api = api
+        self.shards = shards
+
+    def close(self):
+        pass
+
+    def run(self, tasks, callback, hosts=None, block=True, strategy=None,
+            timeout=None):
+        # the shards never wait for other calls, block is ignored
+        if hosts is None:
+            hosts = self.api.inventory
+
+        shards = partition(hosts, self.shards)
+
+        # not worth the processes
+        if len(shards) <= 1:
+            return ExecutionContext(self.api).run(
+                tasks, callback, hosts, strategy=strategy, timeout=timeout)
+
+        log.debug(u'running {} shards'.format(len(shards)))
+
+        # the shards share the connections of the pool, so its directory
+        # is created before they are forked
+        pool = self.api.connection_pool
+
+        if pool is not None:
+            pool.get_directory()
+
+        executor = ProcessPoolExecutor(
+            max_workers=len(shards),
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=start_shard,
+            initargs=(self.api, tasks, strategy, timeout)
+        )
+
+        with executor:
+            futures = [executor.submit(run_shard, s) for s in shards]
+
+            timed_out = False
+
+            for future in as_completed(futures):
+                result = future.result()
+                replay(result['events'], callback)
+
+                if result['pool'] is not None:
+                    pool.merge(*result['pool'])
+
+                for span in result['spans']:
+                    self.api.instrumentation.emit(
+                        span.name, span.start, span.duration,
+                        **span.attributes)
+
+                for observation in result['observations']:
+                    self.api.fork_policy.observe(*observation)
+
+                timed_out = timed_out or result['timed_out']
+
+        if pool is not None:
+            pool.trim()
+
+        return timed_out
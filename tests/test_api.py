@@ -1,13 +1,15 @@
 import gc
 import os
 import os.path
+import time
 from crypt import crypt
 
 import pytest
 from ansible.utils.display import Display
 
 from suitable.api import Api, list_ansible_modules
-from suitable.errors import ModuleError, UnreachableError
+from suitable.errors import HostTimeoutError, ModuleError, UnreachableError
+from suitable.execution_context import Deadline
 from suitable.mitogen import Api as MitogenApi
 from suitable.mitogen import is_mitogen_supported
 from suitable.runner_results import RunnerResults
@@ -79,6 +81,85 @@ def test_results_multiple_servers():
     assert result.rc('db.seantis.dev') == 1
 
 
+def test_results_columns():
+    result = RunnerResults({
+        'contacted': {
+            'web.seantis.dev': {'rc': 0, 'stdout': 'foo\nbar'},
+            'db.seantis.dev': {'rc': 1}
+        },
+        'unreachable': {}
+    })
+
+    assert result.hosts == ('web.seantis.dev', 'db.seantis.dev')
+    assert result.column('rc') == {'web.seantis.dev': 0, 'db.seantis.dev': 1}
+    assert result.column('stdout_lines') == {'web.seantis.dev': ['foo', 'bar']}
+    assert result.column('changed') == {}
+
+    # columns are built once and read-only
+    assert result.column('rc') is result.column('rc')
+
+    with pytest.raises(TypeError):
+        result.column('rc')['web.seantis.dev'] = 1
+
+    # accessors are built once as well
+    assert result.rc is result.rc
+    assert result.rc('db.seantis.dev') == 1
+
+    with pytest.raises(AttributeError):
+        result.stdout('db.seantis.dev')
+
+    with pytest.raises(AttributeError):
+        result._private
+
+    # the results remain a plain dict
+    assert isinstance(result, dict)
+    assert dict(result)['contacted']['db.seantis.dev']['rc'] == 1
+    assert not hasattr(result, '__dict__')
+
+
+def test_results_queries():
+    result = RunnerResults({
+        'contacted': {
+            'a': {'rc': 0, 'changed': True, 'stdout': 'foo'},
+            'b': {'rc': 1, 'changed': False, 'stdout': 'bar'},
+            'c': {'rc': 0, 'changed': True, 'stdout': 'bar'},
+            'd': {'rc': 0, 'changed': False},
+        },
+        'unreachable': {'e': {}}
+    })
+
+    changed = result.filter(changed=True)
+    assert changed.hosts == ('a', 'c')
+    assert changed['unreachable'] == {}
+    assert changed.rc('a') == 0
+
+    assert result.filter(changed=False, rc=0).hosts == ('d', )
+    assert result.filter(stdout=None).hosts == ()
+    assert result.filter().hosts == ('a', 'b', 'c', 'd')
+
+    assert result.group_by('stdout') == {'foo': ('a', ), 'bar': ('b', 'c')}
+    assert result.count_by('rc') == {0: 3, 1: 1}
+    assert result.group_by('stdout_lines') == {
+        ('foo', ): ('a', ), ('bar', ): ('b', 'c')
+    }
+    assert result.count_by('stdout_lines') == {('foo', ): 1, ('bar', ): 2}
+    assert result.hosts_where(lambda r: r['rc'] and not r['changed']) \
+        == ('b', )
+
+
+def test_results_array():
+    numpy = pytest.importorskip('numpy')
+
+    result = RunnerResults({
+        'contacted': {'a': {'rc': 0}, 'b': {'rc': 2}, 'c': {}},
+        'unreachable': {}
+    })
+
+    array = result.array('rc', default=-1)
+    assert isinstance(array, numpy.ndarray)
+    assert array.tolist() == [0, 2, -1]
+
+
 @pytest.mark.parametrize("server", (('localhost', 'localhost:22'),))
 def test_whoami_multiple_servers(server):
     host = Api(server)
@@ -110,6 +191,21 @@ def test_list_ansible_modules():
     assert 'setup' in modules
 
 
+def test_lazy_modules():
+    api = Api('localhost', lazy=True)
+    assert 'command' not in vars(api)
+
+    assert api.command('whoami').rc() == 0
+    assert 'command' in vars(api)
+    assert api.command == api.command
+
+    with pytest.raises(AttributeError):
+        api.no_such_module
+
+    with pytest.raises(AttributeError):
+        api._private
+
+
 def test_module_error():
     with pytest.raises(ModuleError):
         # command cannot include pipes
@@ -313,3 +409,403 @@ def test_interleaving(container):
 
     assert foo.command('id -g').stdout() == '1000'
     assert bar.command('id -g').stdout() == '1001'
+
+
+def test_execution_context_reuse():
+    api = Api('localhost')
+    context = api.get_execution_context()
+    assert context is api.get_execution_context()
+
+    assert api.command('whoami').rc() == 0
+    assert set(context.inventory_manager._inventory.hosts) == {'localhost'}
+
+    # hosts added to the inventory are picked up by the next call
+    api.inventory.add_host('localhost:22', {})
+    assert len(api.command('whoami')['contacted']) == 2
+    assert set(context.hosts) == {'localhost', 'localhost:22'}
+
+    # as are removed hosts
+    del api.inventory['localhost:22']
+    assert len(api.command('whoami')['contacted']) == 1
+    assert set(context.inventory_manager._inventory.hosts) == {'localhost'}
+
+
+def test_execution_context_isolated():
+    api = Api('localhost', isolated=True)
+    assert api.get_execution_context() is not api.get_execution_context()
+    assert api.command('whoami').rc() == 0
+
+
+def test_execution_context_changed_variables(tempdir):
+    api = Api('localhost', extra_vars={'path': tempdir})
+    api.file(dest="{{ path }}/foo.txt", state='touch')
+
+    api.inventory['localhost']['name'] = 'bar.txt'
+    api.file(dest="{{ path }}/{{ name }}", state='touch')
+
+    api.options.extra_vars['path'] = os.path.join(tempdir, 'sub')
+    os.mkdir(os.path.join(tempdir, 'sub'))
+    api.file(dest="{{ path }}/{{ name }}", state='touch')
+
+    assert os.path.exists(os.path.join(tempdir, 'foo.txt'))
+    assert os.path.exists(os.path.join(tempdir, 'bar.txt'))
+    assert os.path.exists(os.path.join(tempdir, 'sub', 'bar.txt'))
+
+
+def test_batch():
+    api = Api('localhost')
+
+    with api.batch() as batch:
+        assert api.command('whoami') is None
+
+        with api.valid_return_codes(0, 1):
+            api.shell('exit 1')
+
+        api.command('echo foo')
+
+    assert len(batch.results) == 3
+    assert batch.results[0].rc() == 0
+    assert batch.results[1].rc() == 1
+    assert batch.results[1].success()
+    assert batch.results[2].stdout() == 'foo'
+
+    # calls outside of the batch are run immediately
+    assert api.command('whoami').rc() == 0
+
+
+def test_batch_module_error():
+    api = Api('localhost')
+
+    with pytest.raises(ModuleError):
+        with api.batch() as batch:
+            api.command('whoami | less')
+            api.command('whoami')
+
+    # the failed host does not run the remaining tasks
+    assert len(batch.results) == 2
+    assert batch.results[0].rc() == 1
+    assert not batch.results[1]['contacted']
+    assert 'localhost' not in api.inventory
+
+
+def test_batch_ignore_errors():
+    api = Api('localhost', ignore_errors=True)
+
+    with api.batch() as batch:
+        api.command('whoami | less')
+        api.command('whoami')
+
+    assert not batch.results[0].success()
+    assert batch.results[1].success()
+
+
+def test_batch_unreachable():
+    host = Api('255.255.255.255', ignore_unreachable=True)
+
+    with host.batch() as batch:
+        host.command('whoami')
+        host.command('whoami')
+
+    assert '255.255.255.255' in batch.results[0]['unreachable']
+    assert '255.255.255.255' in batch.results[1]['unreachable']
+
+
+def test_batch_exception():
+    api = Api('localhost')
+
+    with pytest.raises(RuntimeError):
+        with api.batch() as batch:
+            api.command('whoami')
+            raise RuntimeError()
+
+    assert batch.results is None
+    assert api._batch is None
+
+
+def test_persistent():
+    with Api('localhost', persistent=True) as api:
+        context = api.get_execution_context()
+        assert context.task_queue_manager is None
+
+        assert api.command('whoami').rc() == 0
+        task_queue_manager = context.task_queue_manager
+        assert task_queue_manager is not None
+
+        assert api.command('echo foo').stdout() == 'foo'
+        assert context.task_queue_manager is task_queue_manager
+
+    assert context.task_queue_manager is None
+
+    # the api may be used again after closing it
+    assert api.command('whoami').rc() == 0
+    api.close()
+
+
+def test_persistent_errors():
+    api = Api(('localhost', '255.255.255.255'), persistent=True)
+
+    with pytest.raises(UnreachableError):
+        api.command('whoami')
+
+    # hosts that were unreachable before are not skipped by Ansible
+    api.inventory.add_host('255.255.255.255', {})
+
+    with pytest.raises(UnreachableError):
+        api.command('whoami')
+
+    api.close()
+
+
+def test_persistent_isolated():
+    with pytest.raises(AssertionError):
+        Api('localhost', persistent=True, isolated=True)
+
+
+def test_stream():
+    host = Api(['localhost', '255.255.255.255'], ignore_unreachable=True)
+    results = host.shell.stream('whoami')
+
+    # nothing runs until the results are consumed
+    assert not isinstance(results, list)
+
+    results = dict(results)
+    assert set(results) == {'localhost', '255.255.255.255'}
+
+    assert results['localhost'].rc() == 0
+    assert results['localhost']['unreachable'] == {}
+    assert '255.255.255.255' in results['255.255.255.255']['unreachable']
+
+
+def test_stream_module_error():
+    host = Api('localhost')
+    results = host.shell.stream('exit 1')
+
+    with pytest.raises(ModuleError):
+        next(results)
+
+    # the failing host is taken out of the list
+    host = Api('localhost')
+
+    with host.valid_return_codes(0, 1):
+        results = host.shell.stream('exit 1')
+
+    # return codes valid at the time of the call apply
+    server, result = next(results)
+    assert result.rc() == 1
+    assert result['contacted']['localhost']['success']
+
+    with pytest.raises(StopIteration):
+        next(results)
+
+
+def test_stream_unreachable():
+    host = Api('255.255.255.255')
+
+    with pytest.raises(UnreachableError):
+        list(host.shell.stream('whoami'))
+
+
+def test_stream_in_batch():
+    host = Api('localhost')
+
+    with pytest.raises(AssertionError):
+        with host.batch():
+            host.shell.stream('whoami')
+
+
+def test_on():
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local'},
+        'third': {'ansible_connection': 'local'},
+    })
+    context = api.get_execution_context()
+
+    result = api.on('other').command('echo {{ inventory_hostname }}')
+    assert result.stdout() == 'other'
+    assert set(result['contacted']) == {'other'}
+
+    # only the given hosts are added to the Ansible inventory
+    assert set(context.hosts) == {'other'}
+
+    result = api.command('whoami', _hosts=['localhost', 'other'])
+    assert set(result['contacted']) == {'localhost', 'other'}
+    assert set(context.hosts) == {'localhost', 'other'}
+
+    # the hosts are not limited for the next call
+    assert len(api.command('whoami')['contacted']) == 3
+    assert set(context.hosts) == {'localhost', 'other', 'third'}
+
+    servers = [server for server, _ in api.on('third').command.stream('id')]
+    assert servers == ['third']
+
+    with pytest.raises(KeyError):
+        api.on(['other', 'example.org'])
+
+    with pytest.raises(KeyError):
+        api.command('whoami', _hosts='example.org')
+
+    with pytest.raises(AttributeError):
+        api.on('other').inventory
+
+
+def test_on_batch():
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local'},
+    })
+
+    with api.batch() as batch:
+        api.on('other').command('echo foo')
+        api.command('echo bar', _hosts=['localhost'])
+        api.command('echo baz')
+
+    assert set(batch.results[0]['contacted']) == {'other'}
+    assert set(batch.results[1]['contacted']) == {'localhost'}
+    assert set(batch.results[2]['contacted']) == {'localhost', 'other'}
+    assert batch.results[0].stdout('other') == 'foo'
+
+
+def test_groups():
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local', 'role': 'db'},
+    })
+    api.inventory.add_group('web', ['localhost'], {'port': 80})
+    api.inventory.add_group('db', ['other'], {'port': 5432})
+
+    result = api.command('echo {{ port }} {{ group_names | join(",") }}')
+    assert result.stdout('localhost') == '80 web'
+    assert result.stdout('other') == '5432 db'
+
+    assert api.on('role=db').command('whoami').hosts == ('other', )
+    assert api.on('web').command('whoami').hosts == ('localhost', )
+
+    # changes to the groups are picked up by the next call
+    api.inventory.groups['web'].variables['port'] = 8080
+    api.inventory.add_group('web', ['other'])
+    api.inventory.remove_group('db')
+
+    result = api.command('echo {{ port }} {{ group_names | join(",") }}')
+    assert result.stdout('localhost') == '8080 web'
+    assert result.stdout('other') == '8080 web'
+
+
+def test_pipeline():
+    api = Api({
+        'slow': {'ansible_connection': 'local', 'delay': 3},
+        'fast': {'ansible_connection': 'local', 'delay': 0},
+    })
+
+    with api.pipeline() as pipeline:
+        api.shell('sleep {{ delay }} && date +%s.%N')
+        api.shell('date +%s.%N')
+
+    assert len(pipeline.results) == 2
+
+    slow = [float(r['stdout']) for r in pipeline.host_results('slow')]
+    fast = [float(r['stdout']) for r in pipeline.host_results('fast')]
+
+    # the fast host did not wait for the slow host
+    assert fast[1] < slow[0]
+    assert slow[0] < slow[1]
+
+
+def test_pipeline_module_error():
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local'},
+    })
+
+    with pytest.raises(ModuleError):
+        with api.pipeline() as pipeline:
+            api.shell('test {{ inventory_hostname }} = other')
+            api.command('whoami')
+
+    localhost = pipeline.host_results('localhost')
+    other = pipeline.host_results('other')
+
+    assert localhost[0]['rc'] == 1
+    assert localhost[1] is None
+    assert other[0]['rc'] == 0
+    assert other[1]['stdout']
+
+
+def test_pipeline_strategy():
+    api = Api('localhost', lazy=True)
+
+    with api.pipeline() as pipeline:
+        assert pipeline.strategy == 'free'
+
+    # the strategy of Mitogen apis is kept
+    api.strategy = 'mitogen_linear'
+
+    with api.pipeline() as pipeline:
+        assert pipeline.strategy == 'mitogen_free'
+
+
+def test_timeout():
+    api = Api({
+        'slow': {'ansible_connection': 'local', 'delay': 10},
+        'fast': {'ansible_connection': 'local', 'delay': 0},
+    }, timeout=2)
+
+    start = time.monotonic()
+    result = api.shell('sleep {{ delay }} && echo done')
+
+    assert time.monotonic() - start < 8
+    assert result.stdout('fast') == 'done'
+    assert result['timed_out']['slow']['timeout'] == 2
+    assert set(result['contacted']) == {'fast'}
+
+    # the host is kept by default
+    assert 'slow' in api.inventory
+    assert not api.shell('echo {{ delay }}', _timeout=30)['timed_out']
+
+    streamed = dict(api.shell.stream('sleep {{ delay }}', _timeout=2))
+    assert streamed['slow']['timed_out']['slow']['timed_out']
+    assert streamed['fast']['contacted']['fast']['rc'] == 0
+
+
+def test_custom_host_timeout():
+
+    class CustomApi(Api):
+        def on_host_timeout(self, module, host, timeout):
+            raise HostTimeoutError(module, host, timeout)
+
+    api = CustomApi('localhost')
+
+    with pytest.raises(HostTimeoutError) as e:
+        api.shell('sleep 10', _timeout=1)
+
+    assert str(e.value) == 'localhost did not finish within 1 seconds'
+    assert 'localhost' not in api.inventory
+
+
+def test_deadline_expiring_at_the_end():
+    terminated = []
+
+    class TaskQueueManager(object):
+        def terminate(self):
+            time.sleep(0.5)
+            terminated.append(True)
+
+        def get_workers(self):
+            return []
+
+    # the deadline expires while the play ends
+    with Deadline(TaskQueueManager(), 0.01) as deadline:
+        time.sleep(0.1)
+
+    assert deadline.expired
+    assert terminated
+
+
+def test_persistent_terminated():
+    with Api('localhost', persistent=True) as api:
+        context = api.get_execution_context()
+        assert api.command('whoami').rc() == 0
+
+        # as if a deadline expired right after the last play
+        context.task_queue_manager.terminate()
+        assert api.command('echo foo').stdout() == 'foo'
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+
+from suitable.asyncio import AsyncApi
+
+
+def test_async_api():
+    async def main():
+        async with AsyncApi('localhost') as api:
+            coroutine = api.command('whoami')
+            assert asyncio.iscoroutine(coroutine)
+
+            result = await coroutine
+            assert result.rc() == 0
+
+    asyncio.run(main())
+
+
+def test_async_api_concurrent():
+    async def main():
+        apis = [
+            AsyncApi('localhost', lazy=True, host_key_checking=i % 2 == 0)
+            for i in range(4)
+        ]
+
+        results = await asyncio.gather(*(
+            api.shell('echo {}'.format(i)) for i, api in enumerate(apis)
+        ))
+
+        for api in apis:
+            api.close()
+
+        return results
+
+    previous = os.environ.get('ANSIBLE_HOST_KEY_CHECKING')
+    results = asyncio.run(main())
+
+    assert [r.stdout() for r in results] == ['0', '1', '2', '3']
+    assert os.environ.get('ANSIBLE_HOST_KEY_CHECKING') == previous
+
+
+def test_async_api_same_api_concurrent():
+    async def main():
+        api = AsyncApi({
+            'localhost': {},
+            'other': {'ansible_connection': 'local'},
+        }, lazy=True)
+
+        # the first time calls overlap, they wait for the plugins to be loaded
+        await asyncio.gather(api.command('whoami'), api.command('whoami'))
+
+        start = time.monotonic()
+
+        results = await asyncio.gather(
+            api.on('localhost').shell('sleep 2 && echo first'),
+            api.on('other').shell('sleep 2 && echo second'),
+        )
+
+        api.close()
+
+        return time.monotonic() - start, results
+
+    duration, (first, second) = asyncio.run(main())
+
+    # the calls overlap
+    assert duration < 4
+    assert first.stdout() == 'first'
+    assert second.stdout() == 'second'
+
+
+def test_async_api_errors():
+    async def main():
+        api = AsyncApi('localhost', ignore_errors=True)
+        result = await api.command('whoami | less')
+        assert result.rc() == 1
+        api.close()
+
+        # the api may still be used after closing it
+        assert (await api.command('whoami')).rc() == 0
+
+    asyncio.run(main())
+
+
+def test_async_api_stream():
+    async def main():
+        async with AsyncApi('localhost') as api:
+            return [r async for r in api.shell.stream('echo 1')]
+
+    results = asyncio.run(main())
+
+    assert len(results) == 1
+    assert results[0][0] == 'localhost'
+    assert results[0][1].stdout() == '1'
+
+
+def test_async_api_valid_return_codes():
+    async def main():
+        async with AsyncApi('localhost') as api:
+            with api.valid_return_codes(0, 1):
+                result = await api.shell('exit 1')
+
+                assert [r async for r in api.shell.stream('exit 1')]
+
+            return result
+
+    assert asyncio.run(main()).rc() == 1
+
+
+def test_async_api_batch():
+    async def main():
+        async with AsyncApi('localhost') as api:
+            with api.batch() as batch:
+                assert await api.command('echo 1') is None
+                assert await api.command('echo 2') is None
+
+                assert len(batch.calls) == 2
+
+            return batch.results
+
+    results = asyncio.run(main())
+
+    assert [r.stdout() for r in results] == ['1', '2']
@@ -0,0 +1,104 @@
+import os
+import shlex
+
+from suitable.api import Api
+from suitable.connection_pool import ConnectionPool
+
+
+def touch(path):
+    with open(path, 'w'):
+        pass
+
+
+def test_connection_pool_keys():
+    pool = ConnectionPool()
+    api = Api('example.org', connection_pool=pool, lazy=True)
+    assert api.connection_pool is pool
+
+    assert pool.key(api, 'example.org', {}) == (
+        'example.org', None, api.options.remote_user, False)
+    assert pool.key(api, 'example.org', {'ansible_port': 2222})[1] == 2222
+    assert pool.key(api, 'example.org', {'ansible_connection': 'local'}) \
+        is None
+    assert pool.key(api, 'example.org', {'ansible_connection': 'paramiko'}) \
+        is None
+
+    a = pool.key(api, 'a', {})
+    b = pool.key(api, 'b', {})
+    assert pool.control_path(a) != pool.control_path(b)
+    assert pool.control_path(a) == pool.control_path(a)
+
+    pool.close()
+    assert not os.path.exists(pool.directory)
+
+
+def test_connection_pool_hits_and_misses():
+    pool = ConnectionPool(max_size=2)
+    a, b, c = ('a', None, 'root', False), ('b', None, 'root', False), \
+        ('c', None, 'root', False)
+
+    pool.checkout((a, b))
+    assert (pool.hits, pool.misses) == (0, 2)
+
+    # a master connection has been established for a
+    touch(pool.control_path(a))
+
+    pool.checkout((a, b))
+    assert (pool.hits, pool.misses) == (1, 3)
+
+    # the least recently used connection is dropped
+    pool.checkout((c, ))
+    pool.trim()
+    assert list(pool.connections) == [b, c]
+
+    # connections idle for too long are not counted as hits
+    pool.idle_timeout = -1
+    touch(pool.control_path(c))
+    pool.checkout((c, ))
+    assert (pool.hits, pool.misses) == (1, 5)
+
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_connection_pool_api():
+    api = Api(
+        '255.255.255.255', connection_pool=True, ignore_unreachable=True)
+
+    api.command('whoami')
+    assert (api.connection_pool.hits, api.connection_pool.misses) == (0, 1)
+
+    context = api.get_execution_context()
+    host = context.inventory_manager._inventory.hosts['255.255.255.255']
+    key = context.connection_keys['255.255.255.255']
+    assert host.vars['ansible_control_path'] \
+        == api.connection_pool.control_path(key)
+    assert 'ControlPersist=60s' in host.vars['ansible_ssh_args']
+
+    # pretend the master connection is up
+    touch(api.connection_pool.control_path(key))
+    api.command('whoami')
+    assert (api.connection_pool.hits, api.connection_pool.misses) == (1, 1)
+
+    api.close()
+    assert len(api.connection_pool) == 0
+
+
+def test_connection_pool_ssh_args(monkeypatch):
+    monkeypatch.setenv('ANSIBLE_SSH_ARGS', (
+        '-o ControlMaster=no -oControlPersist=5s '
+        '-o "ProxyCommand=ssh -W %h:%p jump" -o GSSAPIAuthentication=yes'
+    ))
+
+    pool = ConnectionPool(idle_timeout=30)
+    args = shlex.split(pool.ssh_args())
+
+    # the configured args are kept, except for the ones of the pool
+    assert args == [
+        '-o', 'ProxyCommand=ssh -W %h:%p jump',
+        '-o', 'GSSAPIAuthentication=yes',
+        '-o', 'ControlMaster=auto',
+        '-o', 'ControlPersist=30s',
+    ]
+
+    pool.close()
@@ -0,0 +1,103 @@
+import os
+import pytest
+import time
+
+from suitable.api import Api
+from suitable.facts import FactsCache
+
+
+def test_facts_cache():
+    cache = FactsCache(ttl=60)
+    cache.update({'a': {'ansible_os_family': 'Debian'}, 'b': {}})
+
+    assert cache.get('a') == {'ansible_os_family': 'Debian'}
+    assert cache.get('c') is None
+    assert cache.stale(['a', 'b', 'c']) == ['c']
+    assert cache.fresh(['a', 'c']) == {'a': {'ansible_os_family': 'Debian'}}
+
+    # expire the facts of 'a'
+    cache.facts['a'] = (time.time() - 61, cache.facts['a'][1])
+
+    assert cache.get('a') is None
+    assert cache.stale(['a', 'b']) == ['a']
+
+    cache.clear(['b'])
+    assert cache.stale(['a', 'b']) == ['a', 'b']
+
+
+def test_facts_cache_file(tempdir):
+    cache_file = os.path.join(tempdir, 'facts', 'cache.json')
+
+    cache = FactsCache(ttl=60, cache_file=cache_file)
+    cache.update({'a': {'ansible_os_family': 'Debian'}, 'b': {}})
+    cache.facts['b'] = (time.time() - 61, {})
+    cache.save()
+
+    # expired facts are not loaded
+    cache = FactsCache(ttl=60, cache_file=cache_file)
+    assert cache.get('a') == {'ansible_os_family': 'Debian'}
+    assert cache.facts.keys() == {'a'}
+
+    with open(cache_file, 'w') as f:
+        f.write('garbage')
+
+    assert FactsCache(cache_file=cache_file).get('a') is None
+
+
+def gathered_hosts(spans):
+    return sorted(
+        s.attributes['host'] for s in spans
+        if s.name == 'suitable.host' and s.attributes['task'] == 'setup'
+    )
+
+
+def test_facts():
+    spans = []
+
+    api = Api('localhost', instrumentation=[spans.append])
+
+    # without cache, facts are gathered each time
+    assert api.facts('localhost')['ansible_system'] == 'Linux'
+    assert api.facts()['localhost']['ansible_system'] == 'Linux'
+    assert gathered_hosts(spans) == ['localhost', 'localhost']
+
+    with pytest.raises(KeyError):
+        api.facts('example.org')
+
+
+def test_facts_cached():
+    spans = []
+
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local'}
+    }, facts_cache=True, instrumentation=[spans.append])
+
+    api.facts_cache.update({'other': {'ansible_system': 'Plan9'}})
+
+    # only hosts without fresh facts are gathered
+    facts = api.facts()
+    assert facts['localhost']['ansible_system'] == 'Linux'
+    assert facts['other']['ansible_system'] == 'Plan9'
+    assert gathered_hosts(spans) == ['localhost']
+
+    api.facts()
+    api.facts('localhost')
+    assert gathered_hosts(spans) == ['localhost']
+
+    api.facts('other', refresh=True)
+    assert gathered_hosts(spans) == ['localhost', 'other']
+    assert api.facts('other')['ansible_system'] == 'Linux'
+
+
+def test_facts_as_host_variables():
+    api = Api('localhost', facts_cache=FactsCache(ttl=60))
+    api.facts_cache.update({'localhost': {'ansible_system': 'Plan9'}})
+
+    result = api.command(
+        'echo {{ ansible_system }} {{ ansible_facts.system }}')
+    assert result.stdout() == 'Plan9 Plan9'
+
+    # facts changed by Ansible do not change the cache
+    api.setup()
+    assert api.facts_cache.get('localhost') == {'ansible_system': 'Plan9'}
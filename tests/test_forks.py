@@ -0,0 +1,74 @@
+from ansible import constants as C
+from suitable import forks
+from suitable.api import Api
+from suitable.forks import ForkPolicy
+
+
+def test_fork_policy_limits():
+    policy = ForkPolicy(minimum=2, maximum=10)
+
+    assert policy.choose(hosts=100) == 10
+    assert policy.choose(hosts=5) == 5
+    assert policy.choose(hosts=1) == 2
+    assert policy.forks == 2
+
+
+def test_fork_policy_resources():
+    policy = ForkPolicy()
+
+    assert policy.limit >= 1
+    assert policy.choose(hosts=100000) == policy.limit
+
+
+def test_fork_policy_low_memory(monkeypatch):
+    monkeypatch.setattr(forks, 'available_memory', lambda: 100 * 1024 ** 2)
+
+    policy = ForkPolicy()
+    assert policy.limit == C.DEFAULT_FORKS
+    assert policy.choose(hosts=100) == C.DEFAULT_FORKS
+
+
+def test_fork_policy_configured(monkeypatch):
+    monkeypatch.setenv('ANSIBLE_FORKS', '3')
+    assert ForkPolicy().choose(hosts=100) == 3
+
+    monkeypatch.delenv('ANSIBLE_FORKS')
+    assert ForkPolicy().maximum is None
+
+
+def test_fork_policy_observations():
+    policy = ForkPolicy(maximum=1000)
+    policy.cpus = 2
+
+    # 100 hosts, 10 forks, 10 seconds -> each host took a second, of which
+    # 100ms were spent on the CPU, so 10 forks keep a CPU busy
+    policy.observe(hosts=100, forks=10, seconds=10, cpu_seconds=10)
+
+    assert policy.latency == 1
+    assert policy.cpu_per_host == 0.1
+    assert policy.choose(hosts=500) == 20
+    assert policy.choose(hosts=15) == 15
+
+    # the observations are averaged
+    policy.observe(hosts=100, forks=20, seconds=15, cpu_seconds=10)
+
+    assert policy.latency == 2
+    assert policy.choose(hosts=500) == 40
+    assert list(policy.history) == [(100, 10, 10), (100, 20, 15)]
+
+    # failed or empty calls are not observed
+    policy.observe(hosts=0, forks=20, seconds=1, cpu_seconds=1)
+    assert len(policy.history) == 2
+
+
+def test_fork_policy_api():
+    api = Api('localhost localhost:22', forks=ForkPolicy(maximum=4))
+    api.command('whoami')
+
+    assert api.fork_policy.forks == 2
+    assert api.fork_policy.latency > 0
+    assert len(api.fork_policy.history) == 1
+
+    api = Api('localhost', forks=3)
+    assert api.fork_policy.choose(hosts=10) == 3
+    assert api.options.forks == 3
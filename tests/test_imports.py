@@ -0,0 +1,24 @@
+import subprocess  # nosec
+import sys
+
+
+def test_import_does_not_load_ansible():
+    statement = (
+        "import sys, suitable; "
+        "print(any(m.split('.')[0] == 'ansible' for m in sys.modules))"
+    )
+
+    output = subprocess.check_output(  # nosec
+        [sys.executable, '-c', statement], universal_newlines=True)
+
+    assert output.strip() == 'False'
+
+
+def test_lazy_attributes():
+    import suitable
+    from suitable.api import Api
+
+    assert suitable.Api is Api
+    assert suitable.runner_results.RunnerResults
+    assert 'Api' in dir(suitable)
+    assert not hasattr(suitable, 'foo')
@@ -0,0 +1,105 @@
+import pytest
+
+from suitable.api import Api
+from suitable.errors import ModuleError
+from suitable.instrumentation import Instrumentation, NULL_SPAN
+from suitable.instrumentation import OpenTelemetryHook, Span
+
+
+def test_instrumentation_without_hooks():
+    instrumentation = Instrumentation()
+
+    assert not instrumentation
+    assert instrumentation.span('foo') is NULL_SPAN
+
+
+def test_instrumentation_spans():
+    spans = []
+
+    def failing_hook(span):
+        raise RuntimeError()
+
+    api = Api('localhost', instrumentation=[failing_hook, spans.append])
+    api.command('whoami')
+
+    assert [s.name for s in spans] == [
+        'suitable.inventory',
+        'suitable.play_load',
+        'suitable.task_queue_manager',
+        'suitable.host',
+        'suitable.run',
+        'suitable.evaluate',
+        'suitable.call',
+    ]
+
+    spans = {s.name: s for s in spans}
+    assert spans['suitable.call'].attributes == {'module': 'command'}
+    assert spans['suitable.run'].attributes['hosts'] == 1
+    assert spans['suitable.host'].attributes == {
+        'host': 'localhost',
+        'task': 'command',
+        'status': 'ok'
+    }
+
+    # the sections are part of the call
+    call = spans['suitable.call']
+
+    for span in spans.values():
+        assert span.duration >= 0
+        assert span.start >= call.start
+        assert span.start + span.duration <= call.start + call.duration
+
+    assert spans['suitable.host'].duration <= spans['suitable.run'].duration
+
+    # hosts are timed from the start of the play, not including the setup
+    setup = spans['suitable.task_queue_manager']
+    assert spans['suitable.host'].start >= setup.start + setup.duration
+
+
+def test_instrumentation_errors():
+    spans = []
+
+    api = Api('localhost')
+    api.instrumentation.add(spans.append)
+
+    with pytest.raises(ModuleError):
+        api.command('false')
+
+    spans = {s.name: s for s in spans}
+    assert spans['suitable.host'].attributes['status'] == 'failed'
+    assert spans['suitable.evaluate'].attributes['error'] == 'ModuleError'
+    assert spans['suitable.call'].attributes['error'] == 'ModuleError'
+
+
+def test_instrumentation_batch():
+    spans = []
+
+    api = Api('localhost', instrumentation=[spans.append])
+
+    with api.batch():
+        api.command('whoami')
+        api.command('whoami')
+
+    assert [s.attributes['task'] for s in spans if s.name == 'suitable.host'] \
+        == ['Suitable Task 0', 'Suitable Task 1']
+    assert spans[-1].name == 'suitable.call'
+    assert spans[-1].attributes == {'tasks': 2}
+
+
+def test_open_telemetry_hook():
+    ended = []
+
+    class Tracer(object):
+        def start_span(self, name, start_time, attributes):
+            class Span(object):
+                def end(self, end_time):
+                    ended.append((name, start_time, end_time, attributes))
+
+            return Span()
+
+    hook = OpenTelemetryHook(Tracer())
+    hook(Span('foo', 1.5, 0.5, {'hosts': 1, 'args': {'a': 'b'}}))
+
+    assert ended == [
+        ('foo', 1500000000, 2000000000, {'hosts': 1, 'args': "{'a': 'b'}"})
+    ]
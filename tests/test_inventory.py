@@ -23,3 +23,61 @@ def test_host_dict():
     inventory = Inventory(hosts=hosts)
     assert 'host.example.org' in inventory
     assert inventory['example.org']['key1'] == 'var1'
+
+
+def test_groups():
+    inventory = Inventory(hosts=['web1', 'web2', 'db1'])
+    inventory.add_group('web', ['web1', 'web2'], {'http_port': 80})
+    inventory.add_group('web', ['web2'], {'https_port': 443})
+    inventory.add_host('db2', {}, groups=['db'])
+
+    assert inventory.groups['web'].hosts == {'web1', 'web2'}
+    assert inventory.groups['web'].variables == {
+        'http_port': 80, 'https_port': 443}
+    assert inventory.groups['db'].hosts == {'db2'}
+    assert inventory.group_names('web2') == ['web']
+
+    # group variables are not copied into the hosts
+    assert inventory['web1'] == {}
+
+    with pytest.raises(KeyError):
+        inventory.add_group('web', ['web3'])
+
+    with pytest.raises(AssertionError):
+        inventory.add_group('all')
+
+
+def test_select():
+    inventory = Inventory(hosts={
+        'web1': {'role': 'web'},
+        'web2': {'role': 'web'},
+        'web10': {'role': 'web', 'port': 8080},
+        'db1': {'role': 'db'},
+        'db2': {},
+    })
+    inventory.add_group('databases', ['db1', 'db2'], {'role': 'db'})
+
+    assert inventory.select('web1') == ['web1']
+    assert inventory.select('databases') == ['db1', 'db2']
+    assert inventory.select('web*') == ['web1', 'web10', 'web2']
+    assert inventory.select('web?') == ['web1', 'web2']
+    assert inventory.select('*1') == ['db1', 'web1']
+    assert inventory.select('role=web') == ['web1', 'web10', 'web2']
+    assert inventory.select('port=8080') == ['web10']
+    assert inventory.select('role=mail') == []
+
+    # group variables apply, unless overridden by the host
+    assert inventory.select('role=db') == ['db1', 'db2']
+
+    inventory['db2']['role'] = 'backup'
+    assert inventory.select('role=db') == ['db1']
+
+    # the index is updated when hosts are added or removed
+    inventory.add_host('web3', {'role': 'web'})
+    del inventory['web1']
+    assert inventory.select('web*') == ['web10', 'web2', 'web3']
+    assert inventory.select('role=web') == ['web10', 'web2', 'web3']
+    assert inventory.select('databases') == ['db1', 'db2']
+
+    with pytest.raises(KeyError):
+        inventory.select('web4')
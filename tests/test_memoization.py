@@ -0,0 +1,127 @@
+import time
+
+from suitable.api import Api
+from suitable.memoization import Memoization
+
+
+def local_hosts(*names):
+    return {name: {'ansible_connection': 'local'} for name in names}
+
+
+def called_hosts(spans):
+    return sorted(
+        s.attributes['host'] for s in spans if s.name == 'suitable.host')
+
+
+def test_memoization():
+    spans = []
+
+    api = Api(
+        local_hosts('a', 'b'),
+        memoization=True,
+        instrumentation=[spans.append]
+    )
+
+    first = api.stat(path='/etc/hosts')
+    assert called_hosts(spans) == ['a', 'b']
+
+    second = api.stat(path='/etc/hosts')
+    assert called_hosts(spans) == ['a', 'b']
+
+    assert first['contacted'] == second['contacted']
+    assert api.memoization.hits == 2
+    assert api.memoization.misses == 2
+
+    # the results are copies
+    second['contacted']['a']['stat']['exists'] = False
+    assert api.stat(path='/etc/hosts')['contacted']['a']['stat']['exists']
+
+    # other arguments are not memoized
+    api.stat(path='/etc/passwd')
+    assert called_hosts(spans) == ['a', 'a', 'b', 'b']
+
+    # only the missing hosts are called
+    api.inventory.update(local_hosts('c'))
+    api.stat(path='/etc/hosts')
+    assert called_hosts(spans) == ['a', 'a', 'b', 'b', 'c']
+
+    # other modules are not memoized
+    api.command('whoami')
+    api.command('whoami')
+    assert len(called_hosts(spans)) == 11
+
+    api.memoization.clear('stat')
+    api.stat(path='/etc/hosts')
+    assert len(called_hosts(spans)) == 14
+
+
+def test_memoization_failures():
+    api = Api(local_hosts('a'), memoization=Memoization(modules=['command']))
+
+    with api.valid_return_codes(0, 1):
+        api.command('false')
+
+    # failed results are not memoized, even if they are valid
+    assert len(api.memoization) == 0
+
+    api.command('whoami')
+    assert len(api.memoization) == 1
+
+
+def test_memoization_eviction():
+    memoization = Memoization(ttl=60, max_size=2)
+
+    memoization.put('x', {
+        'a': {'success': True, 'result': {}},
+        'b': {'success': True, 'result': {}},
+    })
+    memoization.get('x', ['a'])
+    memoization.put('y', {'a': {'success': True, 'result': {}}})
+
+    # the least recently used result is evicted
+    assert set(memoization.results) == {('x', 'a', None), ('y', 'a', None)}
+
+    memoization.results[('y', 'a', None)] = (time.time() - 61, {})
+    assert memoization.get('y', ['a']) == {}
+    assert len(memoization) == 1
+
+
+def test_memoization_key():
+    api = Api('localhost', lazy=True)
+    memoization = Memoization()
+
+    key = memoization.key(api, 'stat', {'path': '/', 'follow': True})
+    assert key == memoization.key(api, 'stat', {'follow': True, 'path': '/'})
+
+    api.options.become = True
+    assert key != memoization.key(api, 'stat', {'path': '/', 'follow': True})
+
+
+def test_memoization_variables():
+    api = Api('localhost', memoization=True, extra_vars={'p': '/etc/hosts'})
+
+    def exists():
+        return api.stat(path='{{ p }}')['contacted']['localhost']['stat'][
+            'exists']
+
+    assert exists()
+
+    # the arguments are templated with other variables
+    api.options.extra_vars['p'] = '/does/not/exist'
+    assert not exists()
+
+    api.inventory['localhost']['p'] = '/etc/hosts'
+    assert exists()
+
+    api.inventory.add_group('web', ['localhost'], {'q': 1})
+    exists()
+
+    assert api.memoization.hits == 0
+
+    # a memoization shared by apis tells their hosts apart
+    other = Api({'localhost': {'ansible_connection': 'local', 'x': 1}},
+                memoization=api.memoization)
+    other.stat(path='/etc/hosts')
+    api.stat(path='/etc/hosts')
+
+    assert api.memoization.hits == 0
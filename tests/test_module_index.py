@@ -0,0 +1,78 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from suitable.module_index import ModuleIndex
+
+
+def touch(path):
+    with open(path, 'w'):
+        pass
+
+
+def test_module_index(tempdir):
+    os.mkdir(os.path.join(tempdir, 'sub'))
+    touch(os.path.join(tempdir, 'foo.py'))
+    touch(os.path.join(tempdir, 'foo.pyc'))
+    touch(os.path.join(tempdir, '_bar.py'))
+    touch(os.path.join(tempdir, 'sub', 'baz.ps1'))
+
+    index = ModuleIndex()
+    assert index.modules([tempdir]) == {'foo', 'baz'}
+    assert index.is_current([tempdir])
+    assert not index.is_current([tempdir, '/does/not/exist'])
+
+    # adding a module invalidates the index
+    touch(os.path.join(tempdir, 'sub', 'qux.py'))
+    assert not index.is_current([tempdir])
+    assert index.modules([tempdir]) == {'foo', 'baz', 'qux'}
+
+    # so does creating a path that did not exist before
+    missing = os.path.join(tempdir, 'missing')
+    assert index.modules([missing]) == set()
+
+    os.mkdir(missing)
+    touch(os.path.join(missing, 'new.py'))
+    assert index.modules([missing]) == {'new'}
+
+
+def test_module_index_cache_file(tempdir):
+    modules = os.path.join(tempdir, 'modules')
+    cache_file = os.path.join(tempdir, 'cache', 'modules.json')
+
+    os.mkdir(modules)
+    touch(os.path.join(modules, 'foo.py'))
+
+    assert ModuleIndex(cache_file).modules([modules]) == {'foo'}
+    assert os.path.exists(cache_file)
+
+    # a new index is loaded from disk without scanning
+    index = ModuleIndex(cache_file)
+    assert index.load()
+    assert index.is_current([modules])
+    assert index.modules([modules]) == {'foo'}
+
+    # the persisted index is invalidated like the in-memory one
+    os.unlink(os.path.join(modules, 'foo.py'))
+    assert ModuleIndex(cache_file).modules([modules]) == set()
+
+    # a broken cache file is ignored
+    with open(cache_file, 'w') as f:
+        f.write('{')
+
+    assert ModuleIndex(cache_file).modules([modules]) == set()
+
+
+def test_module_index_threads(tempdir):
+    for i in range(50):
+        touch(os.path.join(tempdir, 'module{}.py'.format(i)))
+
+    index = ModuleIndex()
+
+    # alternating paths force a scan on each call
+    paths = ([tempdir], [tempdir, os.path.join(tempdir, 'missing')])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda i: index.modules(paths[i % 2]), range(200)))
+
+    assert all(len(r) == 50 for r in results)
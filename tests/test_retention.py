@@ -0,0 +1,82 @@
+import gc
+import os
+
+from suitable.api import Api
+from suitable.retention import ResultRetention, SpilledOutput
+
+
+def test_retention_keys():
+    retention = ResultRetention(keys=('stdout', ))
+    result = {'stdout': 'foo', 'stderr': 'bar', 'rc': 0, 'cmd': 'echo'}
+
+    assert retention.apply(result) == {'stdout': 'foo', 'rc': 0}
+
+    # the original result is left alone
+    assert 'cmd' in result
+
+    # failed results keep the reason of the failure
+    result = {'rc': 1, 'failed': True, 'msg': 'non-zero return code',
+              'stderr': 'error', 'module_stderr': '', 'cmd': 'false'}
+
+    assert retention.apply(result) == {
+        'rc': 1, 'failed': True, 'msg': 'non-zero return code',
+        'stderr': 'error', 'module_stderr': ''
+    }
+
+
+def test_retention_max_output():
+    retention = ResultRetention(max_output=3)
+    result = retention.apply({'stdout': 'foobar', 'stderr': 'baz'})
+
+    assert result['stdout'] == 'foo'
+    assert result['stderr'] == 'baz'
+    assert result['truncated'] == ['stdout']
+
+
+def test_retention_drop_lines():
+    retention = ResultRetention(drop_lines=True)
+    result = retention.apply({
+        'stdout': 'foo\nbar',
+        'stdout_lines': ['foo', 'bar'],
+        'stderr_lines': [],
+    })
+
+    assert result == {'stdout': 'foo\nbar'}
+
+
+def test_retention_spill(tempdir):
+    retention = ResultRetention(
+        spill_threshold=3, max_output=2, spill_directory=tempdir)
+
+    result = retention.apply({'stdout': 'foobar', 'stderr': 'baz'})
+
+    # spilled output is not truncated
+    assert isinstance(result['stdout'], SpilledOutput)
+    assert result['stdout'].read() == 'foobar'
+    assert result['stdout'].mmap()[:] == b'foobar'
+    assert result['stderr'] == 'ba'
+
+    path = result['stdout'].path
+    assert os.path.exists(path)
+
+    del result
+    gc.collect()
+
+    assert not os.path.exists(path)
+
+
+def test_api_result_retention(tempdir):
+    host = Api('localhost', result_retention=ResultRetention(
+        keys=('stdout', ), drop_lines=True, spill_threshold=5,
+        spill_directory=tempdir
+    ))
+
+    result = host.shell('echo foo && echo barbaz')
+    contacted = result['contacted']['localhost']
+
+    assert set(contacted) == {'stdout', 'rc', 'changed', 'success'}
+    assert isinstance(contacted['stdout'], SpilledOutput)
+
+    assert result.stdout() == 'foo\nbarbaz'
+    assert result.stdout_lines() == ['foo', 'barbaz']
+    assert result.rc() == 0
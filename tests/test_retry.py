@@ -0,0 +1,187 @@
+import pytest
+import time
+
+from suitable.api import Api
+from suitable.errors import ModuleError, UnreachableError
+from suitable.retry import HostHealth, RetryPolicy
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(backoff=1, max_backoff=5, jitter=0)
+    assert [policy.delay(a) for a in range(1, 6)] == [1, 2, 4, 5, 5]
+
+    policy = RetryPolicy(backoff=1, jitter=0.5)
+    assert all(0.5 <= policy.delay(1) <= 1 for _ in range(100))
+
+    with pytest.raises(AssertionError):
+        RetryPolicy(attempts=0)
+
+
+def test_host_health():
+    health = HostHealth(threshold=2, cooldown=60)
+
+    assert not health.record_failure('a')
+    assert not health.is_quarantined('a')
+
+    assert health.record_failure('a')
+    assert health.quarantined() == {'a'}
+
+    # once the cooldown is over, the host is tried again
+    health.quarantine_ends['a'] = time.monotonic()
+    assert not health.is_quarantined('a')
+
+    # a single failure sends it back
+    assert health.record_failure('a')
+    assert health.is_quarantined('a')
+
+    health.record_success('a')
+    assert not health.is_quarantined('a')
+    assert not health.record_failure('a')
+
+    health.quarantine('b')
+    assert health.quarantined() == {'b'}
+
+    health.release()
+    assert health.quarantined() == set()
+
+
+def unreachable_host():
+    # nothing listens on port 1, so the connection is refused right away
+    return {
+        'ansible_host': '127.0.0.2',
+        'ansible_port': 1,
+        'ansible_connection': 'ssh'
+    }
+
+
+def test_retry():
+    spans = []
+
+    def hook(span):
+        if span.name == 'suitable.host':
+            spans.append((span.attributes['host'], span.attributes['status']))
+
+            # the host becomes reachable after the first attempt
+            if span.attributes['status'] == 'unreachable':
+                api.inventory['flaky'] = {'ansible_connection': 'local'}
+
+    api = Api({
+        'localhost': {},
+        'flaky': unreachable_host(),
+    }, retry=RetryPolicy(attempts=3, backoff=0.1), instrumentation=[hook])
+
+    result = api.command('whoami')
+
+    assert set(result['contacted']) == {'localhost', 'flaky'}
+    assert not result['unreachable']
+    assert sorted(spans) == [
+        ('flaky', 'ok'), ('flaky', 'unreachable'), ('localhost', 'ok')
+    ]
+
+
+def test_retry_exhausted():
+    spans = []
+
+    api = Api(
+        {'unreachable': unreachable_host()},
+        retry=2,
+        ignore_unreachable=True,
+        instrumentation=[spans.append]
+    )
+
+    result = api.command('whoami')
+    assert set(result['unreachable']) == {'unreachable'}
+
+    runs = [s for s in spans if s.name == 'suitable.run']
+    assert len(runs) == 2
+
+
+def test_health():
+    api = Api({
+        'localhost': {},
+        'broken': unreachable_host(),
+    }, health=HostHealth(cooldown=60))
+
+    with pytest.raises(UnreachableError):
+        api.command('whoami')
+
+    # the host is quarantined instead of removed
+    assert 'broken' in api.inventory
+    assert api.health.is_quarantined('broken')
+
+    result = api.command('whoami')
+    assert set(result['contacted']) == {'localhost'}
+    assert not result['unreachable']
+
+    # quarantined hosts are skipped in batches as well
+    with api.batch() as batch:
+        api.command('whoami')
+
+    assert set(batch.results[0]['contacted']) == {'localhost'}
+
+    # once released, the host is tried again
+    api.health.release('broken')
+    api.inventory['broken'] = {'ansible_connection': 'local'}
+
+    result = api.command('whoami')
+    assert set(result['contacted']) == {'localhost', 'broken'}
+
+
+def test_health_threshold():
+    api = Api({
+        'localhost': {},
+        'broken': unreachable_host(),
+    }, health=HostHealth(threshold=2, cooldown=60))
+
+    with pytest.raises(UnreachableError):
+        api.command('whoami')
+
+    # the failure is counted once and the host is kept until the threshold
+    assert api.health.failures == {'broken': 1}
+    assert not api.health.is_quarantined('broken')
+
+    with pytest.raises(UnreachableError):
+        api.command('whoami')
+
+    assert api.health.quarantined() == {'broken'}
+
+    result = api.command('whoami')
+    assert set(result['contacted']) == {'localhost'}
+
+
+def test_health_stream_timeout():
+    api = Api({
+        'slow': {'ansible_connection': 'local', 'delay': 10},
+        'quarantined': {'ansible_connection': 'local', 'delay': 10},
+    }, health=True)
+
+    api.health.quarantine('quarantined')
+
+    streamed = dict(api.shell.stream('sleep {{ delay }}', _timeout=2))
+    assert list(streamed) == ['slow']
+    assert streamed['slow']['timed_out']['slow']['timed_out']
+
+
+def test_health_threshold_module_error():
+    api = Api('localhost', health=HostHealth(threshold=2, cooldown=60))
+
+    with pytest.raises(ModuleError):
+        api.command('false')
+
+    assert api.health.failures == {'localhost': 1}
+    assert not api.health.is_quarantined('localhost')
+
+    with pytest.raises(ModuleError):
+        api.command('false')
+
+    assert api.health.quarantined() == {'localhost'}
+    assert not api.command('whoami')['contacted']
+
+    # a success resets the failures
+    api.health.release()
+
+    with pytest.raises(ModuleError):
+        api.command('false')
+
+    api.command('whoami')
+    assert api.health.failures == {}
@@ -0,0 +1,147 @@
+import os
+import pytest
+
+from suitable import execution_context, sharding
+from suitable.api import Api
+from suitable.errors import ModuleError
+from suitable.sharding import partition, run_shard, start_shard
+
+
+def local_hosts(count):
+    return {
+        'host{}'.format(i): {'ansible_connection': 'local'}
+        for i in range(count)
+    }
+
+
+def test_partition():
+    assert partition(['a', 'b', 'c', 'd', 'e'], 2) == [
+        ['a', 'c', 'e'], ['b', 'd']
+    ]
+    assert partition(['a', 'b'], 4) == [['a'], ['b']]
+    assert partition([], 4) == []
+
+
+def test_shards_in_one_worker(monkeypatch):
+    monkeypatch.setattr(sharding, 'SHARD', {})
+    monkeypatch.setattr(
+        execution_context, 'GLOBAL_STATE', execution_context.GLOBAL_STATE)
+
+    api = Api(local_hosts(4))
+    tasks = [api.shell.get_task('echo 1')]
+
+    # a worker process may be handed more than one shard
+    start_shard(api, tasks, None, None)
+
+    for servers in (['host0', 'host2'], ['host1', 'host3']):
+        result = run_shard(servers)
+
+        assert sorted(e[1] for e in result['events']) == servers
+        assert not result['timed_out']
+        assert result['pool'] is None
+
+
+def test_sharded_connection_pool():
+    hosts = {
+        'host{}'.format(i): {
+            'ansible_host': '127.0.0.2',
+            'ansible_port': i + 1,
+            'ansible_connection': 'ssh'
+        } for i in range(2)
+    }
+
+    api = Api(hosts, shards=2, connection_pool=True, ignore_unreachable=True)
+    pool = api.connection_pool
+
+    api.shell('whoami')
+    directory = pool.directory
+
+    api.shell('whoami')
+
+    # the shards share the pool of the calling process
+    assert pool.directory == directory
+    assert len(pool) == 2
+    assert (pool.hits, pool.misses) == (0, 4)
+
+    api.close()
+    assert not os.path.exists(directory)
+
+
+def test_sharded_api():
+    api = Api(local_hosts(6), shards=3)
+    result = api.shell('echo {{ inventory_hostname }}')
+
+    assert set(result.hosts) == set(api.inventory)
+    assert result.column('stdout') == {h: h for h in api.inventory}
+
+    # the inventory of the calling process is left alone
+    assert len(api.inventory) == 6
+
+
+def test_sharded_api_module_error():
+    api = Api(local_hosts(4), shards=2)
+
+    with pytest.raises(ModuleError):
+        api.shell('echo {{ inventory_hostname }} | grep -v host1')
+
+    # the error handling happens in the calling process
+    assert 'host1' not in api.inventory
+    assert len(api.inventory) == 3
+
+
+def test_sharded_instrumentation():
+    spans = []
+
+    api = Api(local_hosts(4), shards=2, instrumentation=[spans.append])
+    api.shell('whoami')
+
+    names = [s.name for s in spans]
+
+    # the spans of the shards are passed on to the calling process
+    assert names.count('suitable.run') == 2
+    assert names.count('suitable.host') == 4
+    assert names.count('suitable.call') == 1
+
+
+def test_sharded_fork_policy():
+    api = Api(local_hosts(4), shards=2)
+    api.shell('whoami')
+
+    # the observations of the shards are passed on to the calling process
+    assert [h[0] for h in api.fork_policy.history] == [2, 2]
+    assert api.fork_policy.latency
+
+
+def test_sharded_api_unreachable():
+    hosts = local_hosts(3)
+    hosts['255.255.255.255'] = {}
+
+    api = Api(hosts, shards=2, ignore_unreachable=True)
+    result = api.shell('whoami')
+
+    assert set(result['contacted']) == {'host0', 'host1', 'host2'}
+    assert set(result['unreachable']) == {'255.255.255.255'}
+
+
+def test_sharded_batch():
+    api = Api(local_hosts(4), shards=2)
+
+    with api.batch() as batch:
+        api.shell('echo foo')
+        api.shell('echo {{ inventory_hostname }}')
+
+    assert batch.results[0].count_by('stdout') == {'foo': 4}
+    assert batch.results[1].column('stdout') == {h: h for h in api.inventory}
+
+
+def test_sharded_stream():
+    api = Api(local_hosts(4), shards=2)
+    results = dict(api.shell.stream('echo {{ inventory_hostname }}'))
+
+    assert {h: r.stdout() for h, r in results.items()} \
+        == {h: h for h in api.inventory}
+
+
+def test_sharded_persistent():
+    with pytest.raises(AssertionError):
+        Api('localhost', shards=2, persistent=True)
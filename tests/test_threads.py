@@ -0,0 +1,132 @@
+import os
+import pytest
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from suitable.api import Api
+from suitable.errors import ModuleError
+
+
+def run_in_threads(function, count):
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(function, range(count)))
+
+
+def test_no_cross_talk_between_apis():
+    previous = os.environ.get('ANSIBLE_HOST_KEY_CHECKING')
+
+    def call(i):
+        # every api has a distinct mix of global and per-api settings
+        api = Api(
+            'localhost',
+            lazy=True,
+            dry_run=i % 3 == 0,
+            host_key_checking=i % 2 == 0,
+            environment={'SUITABLE_THREAD': str(i)},
+            extra_vars={'thread': i},
+        )
+
+        outputs = []
+
+        for _ in range(3):
+            # commands are skipped in check mode
+            if api.options.check:
+                output = None
+            else:
+                output = api.shell(
+                    'echo $SUITABLE_THREAD {{ thread }} '
+                    '$ANSIBLE_HOST_KEY_CHECKING').stdout()
+
+            result = api.debug(msg='{{ ansible_check_mode }}')
+            check_mode = result['contacted']['localhost']['msg']
+
+            outputs.append((output, check_mode))
+
+        return outputs
+
+    for i, outputs in enumerate(run_in_threads(call, 8)):
+        if i % 3 == 0:
+            expected = None
+        else:
+            expected = '{i} {i} {checking}'.format(i=i, checking=i % 2 == 0)
+
+        assert outputs == [(expected, i % 3 == 0)] * 3
+
+    assert os.environ.get('ANSIBLE_HOST_KEY_CHECKING') == previous
+
+
+def test_valid_return_codes_per_thread():
+    api = Api('localhost', lazy=True, ignore_errors=True)
+
+    def call(i):
+        if i % 2:
+            with api.valid_return_codes(0, 1):
+                return api.shell('exit 1').success()
+        else:
+            return api.shell('exit 1').success()
+
+    assert run_in_threads(call, 6) == [False, True] * 3
+    assert api._valid_return_codes == (0, )
+
+
+def test_module_args_per_call():
+    api = Api('localhost', lazy=True)
+
+    def call(i):
+        return api.shell('echo {}'.format(i)).stdout()
+
+    assert run_in_threads(call, 6) == [str(i) for i in range(6)]
+
+    # the module runner shared by the calls is left alone
+    assert api.shell.module_args is None
+
+    api.shell.submit('echo 1').result()
+    list(api.shell.stream('echo 1'))
+    assert api.shell.module_args is None
+
+
+def test_submit():
+    api = Api({
+        'localhost': {},
+        'other': {'ansible_connection': 'local'},
+    }, lazy=True)
+
+    # the first time calls overlap, they wait for the plugins to be loaded
+    api.gather(api.command.submit('whoami'), api.command.submit('whoami'))
+
+    start = time.monotonic()
+
+    first = api.on('localhost').shell.submit('sleep 2 && echo first')
+    second = api.on('other').shell.submit('sleep 2 && echo second')
+    assert isinstance(first, Future)
+
+    first, second = api.gather(first, second)
+
+    # the calls overlap
+    assert time.monotonic() - start < 4
+    assert first.stdout() == 'first'
+    assert second.stdout() == 'second'
+    assert second.hosts == ('other', )
+
+    api.close()
+    assert api.command.submit('whoami').result().rc('localhost') == 0
+
+
+def test_submit_errors():
+    api = Api('localhost', lazy=True)
+
+    with api.valid_return_codes(0, 1):
+        valid = api.shell.submit('exit 1')
+
+    invalid = api.shell.submit('exit 1')
+
+    with pytest.raises(ModuleError):
+        api.gather(valid, invalid)
+
+    result, error = api.gather(valid, invalid, return_exceptions=True)
+    assert result.rc() == 1
+    assert isinstance(error, ModuleError)
+
+    with pytest.raises(AssertionError):
+        with api.batch():
+            api.shell.submit('whoami')